@@ -1,54 +1,123 @@
 
-from multiprocessing import Process
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import wait
+import threading
+import time
 
 import logger
-
-from Processes.pushbullet import run_pushbullet
-from Processes.ui import run_screentext_task_ui
-from Processes.clipboardType import run_clip_to_type
+import tracing
+from capture import SharedFrame
+from lazyload import lazy_import, load_attribute
 
 
 class ProcessType():
-    def __init__(self, key, hotkey, force_restart=True):
+    '''
+    Registry entry for a process. The module holding `entrypoint` is only imported
+    on first use, keeping the hotkey-listener parent free of UI and SDK imports.
+    '''
+    def __init__(self, key, hotkey, module=None, entrypoint=None, force_restart=True, pool_size=0, terminate_timeout=None, capture_on_trigger=False):
         self.key = key
         self.hotkey = hotkey
+        self.module = module
+        self.entrypoint = entrypoint
         self.force_restart = force_restart
-
-    def run(self, *args, **kwargs):
-        raise NotImplementedError("Subclasses should implement this method.")
+        # Number of pre-warmed workers kept idle for this process type (0 disables pooling)
+        self.pool_size = pool_size
+        # Seconds to wait for a graceful exit after SIGTERM before killing (None: don't wait)
+        self.terminate_timeout = terminate_timeout
+        # Capture the screen in the parent when triggered and pass it as the first process arg (a SharedFrame)
+        self.capture_on_trigger = capture_on_trigger
+
+    def load(self):
+        if self.module is None or self.entrypoint is None:
+            raise NotImplementedError("Subclasses should set 'module' and 'entrypoint' or override run.")
+        return load_attribute(self.module, self.entrypoint)
+
+    def preload(self):
+        """
+        Import everything `run` needs so a pooled worker only has to start work when triggered.
+        """
+        self.load()
+
+    def run(self, *args, trigger_time=None, **kwargs):
+        return self.load()(*args, **kwargs)
 
 class PTPushbullet(ProcessType):
     def __init__(self):
-        super().__init__("pushbullet", '<cmd>+<shift>+8')
-
-    def run(self, *args, **kwargs):
-        return run_pushbullet(*args, **kwargs)
+        super().__init__("pushbullet", '<cmd>+<shift>+8', "Processes.pushbullet", "run_pushbullet")
 
 class PTScreentextUI(ProcessType):
     def __init__(self):
-        super().__init__("screentext_ui", '<cmd>+<shift>+9')
+        # Wait for an open UI to exit on re-trigger, so the new capture doesn't include its window
+        super().__init__("screentext_ui", '<cmd>+<shift>+9', "Processes.ui", "run_screentext_task_ui", pool_size=1, terminate_timeout=1.0, capture_on_trigger=True)
+
+    def preload(self):
+        super().preload()
+        # The UI needs the model backends as soon as a command is clicked
+        lazy_import("ModelClients").preload_backends()
 
-    def run(self, *args, **kwargs):
-        return run_screentext_task_ui(*args, **kwargs)
+    def run(self, *args, trigger_time=None, **kwargs):
+        return self.load()(*args, trigger_time=trigger_time, **kwargs)
 
 class PTClipToType(ProcessType):
     def __init__(self):
-        super().__init__("clip_to_type", '<cmd>+<shift>+7', force_restart=False)
+        # Typing stops between keys on SIGTERM and releases held keys, which takes a moment
+        super().__init__("clip_to_type", '<cmd>+<shift>+7', "Processes.clipboardType", "run_clip_to_type", force_restart=False, terminate_timeout=2.0)
 
-    def run(self, *args, **kwargs):
-        return run_clip_to_type(*args, **kwargs)
+
+class PTScreenHistory(ProcessType):
+    def __init__(self):
+        # Background service without a hotkey, started by run.py when SCREEN_HISTORY is enabled
+        super().__init__("screen_history", None, "Processes.screenHistory", "run_screen_history", force_restart=False)
 
 
 PROCESS_TYPE_MAP: dict[str, ProcessType] = {
-    pt.key: pt for pt in [PTPushbullet(), PTScreentextUI(), PTClipToType()]
+    pt.key: pt for pt in [PTPushbullet(), PTScreentextUI(), PTClipToType(), PTScreenHistory()]
 }
 
+
+def run_process(proc_runner: ProcessType, process_args=(), trigger_time=None, trace_id=None, warm=False):
+    """
+    Entry point of a triggered process: join the trigger's trace, then run the process type.
+    """
+    tracing.join_trace(trace_id)
+    if trigger_time is not None:
+        tracing.record_span("process_start", trigger_time, process=proc_runner.key, warm=warm)
+    proc_runner.run(*process_args, trigger_time=trigger_time)
+
+
+def run_pooled_worker(proc_runner: ProcessType, conn):
+    """
+    Entry point of a pre-warmed worker: load the heavy imports up front, then idle until triggered.
+    """
+    proc_runner.preload()
+    try:
+        message = conn.recv()
+    except EOFError:
+        return
+    finally:
+        conn.close()
+    if message is None:
+        return
+    process_args, trigger_time, trace_id = message
+    logger.log(f"Warm worker {proc_runner.key} picked up trigger after {(time.time() - trigger_time) * 1000:.1f} ms")
+    run_process(proc_runner, process_args, trigger_time, trace_id, warm=True)
+
+
 class ProcessManager:
-    def __init__(self):
+    def __init__(self, pool_sizes: dict[str, int] = None):
         self.process_type_map = PROCESS_TYPE_MAP
         self.running_processes = {}
-
-    def create_process(self, name, process_args=()):
+        # Shared-memory frames handed to each running process, freed when it exits or is terminated
+        self.shared_frames = {}
+        self.pool_sizes = {name: pt.pool_size for name, pt in self.process_type_map.items()}
+        if pool_sizes is not None:
+            self.pool_sizes.update(pool_sizes)
+        self.warm_workers = {name: [] for name in self.process_type_map}
+        self.pool_lock = threading.Lock()
+        self.pooling_enabled = True
+
+    def create_process(self, name, process_args=(), trigger_time=None, trace_id=None):
         if name not in self.process_type_map:
             raise ValueError(f"Unknown process identifier name: {name}")
         if name in self.running_processes:
@@ -56,26 +125,116 @@ class ProcessManager:
             return
         logger.log(f"Creating new process: {name} with args: {process_args}")
         proc_runner = self.process_type_map[name]
-        self.running_processes[name] = Process(target=proc_runner.run, args=process_args, name=name)
-
-    def reset_process(self, name, process_args=()):
+        self.running_processes[name] = Process(target=run_process, args=(proc_runner, process_args, trigger_time, trace_id), name=name)
+
+    def start_pools(self):
+        for name in self.process_type_map:
+            self.refill_pool(name)
+
+    def refill_pool(self, name):
+        with self.pool_lock:
+            workers = [worker for worker in self.warm_workers[name] if worker[0].is_alive()]
+            while self.pooling_enabled and len(workers) < self.pool_sizes.get(name, 0):
+                parent_conn, child_conn = Pipe()
+                proc = Process(target=run_pooled_worker, args=(self.process_type_map[name], child_conn), name=f"{name}-warm")
+                proc.start()
+                child_conn.close()
+                workers.append((proc, parent_conn))
+                logger.log(f"Started warm worker for: {name}")
+            self.warm_workers[name] = workers
+
+    def refill_pool_in_background(self, name):
+        threading.Thread(target=self.refill_pool, args=(name,), name=f"{name}-pool-refill", daemon=True).start()
+
+    def take_warm_worker(self, name):
+        with self.pool_lock:
+            workers = self.warm_workers[name]
+            while workers:
+                proc, conn = workers.pop(0)
+                if proc.is_alive():
+                    return proc, conn
+                conn.close()
+        return None
+
+    def start_from_pool(self, name, process_args, trigger_time, trace_id=None) -> bool:
+        worker = self.take_warm_worker(name)
+        if worker is None:
+            return False
+        proc, conn = worker
+        try:
+            conn.send((process_args, trigger_time, trace_id))
+        except (BrokenPipeError, OSError) as e:
+            logger.log_error(e, f"Warm worker for {name} is unusable, falling back to a new process")
+            proc.terminate()
+            return False
+        finally:
+            conn.close()
+        self.running_processes[name] = proc
+        self.refill_pool_in_background(name)
+        return True
+
+    def reset_process(self, name, process_args=(), trigger_time=None, trace_id=None, capture=None):
+        """
+        Terminate the running instance of `name` (if any) and start it again.
+        `capture(replaced)` is called once the old instance is gone and its result is prepended to
+        `process_args`, so a screenshot taken there never shows the old instance's window.
+        """
         if name not in self.process_type_map:
             raise ValueError(f"Unknown process identifier name: {name}")
+        if trigger_time is None:
+            trigger_time = time.time()
+        if trace_id is None:
+            trace_id = tracing.current_trace_id()
         proc_runner = self.process_type_map[name]
-        was_running = name in self.running_processes and self.running_processes[name].is_alive()
-        self.terminate_process(name)
-        if proc_runner.force_restart or not was_running:
-            self.create_process(name, process_args)
-            self.running_processes[name].start()
-            logger.log(f"Started process: {name}")
+        with tracing.span("reset_process", process=name) as span:
+            was_running = name in self.running_processes and self.running_processes[name].is_alive()
+            self.terminate_process(name)
+            if proc_runner.force_restart or not was_running:
+                if capture is not None:
+                    process_args = tuple(capture(was_running)) + tuple(process_args)
+                shared_frames = [arg for arg in process_args if isinstance(arg, SharedFrame)]
+                self.shared_frames[name] = shared_frames
+                if self.start_from_pool(name, process_args, trigger_time, trace_id):
+                    span.set(warm=True)
+                    logger.log(f"Started process: {name} (warm)")
+                else:
+                    self.create_process(name, process_args, trigger_time, trace_id)
+                    self.running_processes[name].start()
+                    span.set(warm=False)
+                    logger.log(f"Started process: {name}")
+                if shared_frames:
+                    self.release_on_exit(self.running_processes[name], shared_frames)
+            else:
+                self.release_shared_frames([arg for arg in process_args if isinstance(arg, SharedFrame)])
+
+    def release_shared_frames(self, shared_frames):
+        for shared_frame in shared_frames:
+            shared_frame.unlink()
+
+    def release_on_exit(self, proc, shared_frames):
+        """
+        Free `shared_frames` as soon as `proc` exits, rather than on the next trigger of its process type.
+        """
+        def wait_and_release():
+            wait([proc.sentinel])
+            self.release_shared_frames(shared_frames)
+        threading.Thread(target=wait_and_release, name=f"{proc.name}-frames", daemon=True).start()
     
     def terminate_process(self, name):
+        self.release_shared_frames(self.shared_frames.pop(name, []))
         if name not in self.running_processes:
             # IGNORED: Process not running
             return
-        if self.running_processes[name].is_alive():
+        proc = self.running_processes[name]
+        if proc.is_alive():
             logger.log(f"Terminating process: {name}")
-            self.running_processes[name].terminate()
+            proc.terminate()
+            timeout = self.process_type_map[name].terminate_timeout
+            if timeout is not None:
+                proc.join(timeout)
+                if proc.is_alive():
+                    logger.log(f"Process {name} did not exit within {timeout} s, killing it")
+                    proc.kill()
         del self.running_processes[name]
         return
     
@@ -83,5 +242,14 @@ class ProcessManager:
         logger.log("Terminating all processes")
         for name in list(self.running_processes.keys()):
             self.terminate_process(name)
+        for name in list(self.shared_frames.keys()):
+            self.release_shared_frames(self.shared_frames.pop(name))
+        with self.pool_lock:
+            self.pooling_enabled = False
+            for name, workers in self.warm_workers.items():
+                for proc, conn in workers:
+                    if proc.is_alive():
+                        proc.terminate()
+                    conn.close()
+                self.warm_workers[name] = []
         return
-
@@ -1,3 +1,5 @@
+import os
+import signal
 import time
 
 from pynput import keyboard
@@ -5,35 +7,209 @@ import pyperclip
 
 import logger
 
-def run_clip_to_type():
-    # Retrieve text from clipboard and simulate typing with human-like delay.
-    text = pyperclip.paste()
-    logger.log(f"Typing clipboard text. Length: {len(text)} chars")
-    kb = keyboard.Controller()
+# Ignored characters:
+#   \r (carriage return),
+#   \x00 (null character),
+#   \x0b (vertical tab),
+#   \x0c (form feed),
+IGNORED_CHARS = {'\r', '\x00', '\x0b', '\x0c'}
+
+# Characters sent as named keys
+SPECIAL_KEYS = {
+    '\n': keyboard.Key.enter,
+    '\t': keyboard.Key.tab,
+    ' ': keyboard.Key.space,
+}
+
+# Typing rate profiles:
+#   cps: starting rate in characters/sec, adapted between min_cps and max_cps
+#   break_cost: a newline or tab counts as this many characters (editors may auto-indent or complete on them)
+#   batch: longest run of plain characters sent in one go (1 sends each key separately)
+#   settle_every / settle_time: pause every N characters so the target app can drain its input queue
+RATE_PROFILES = {
+    "human": {"cps": 25, "min_cps": 10, "max_cps": 40, "break_cost": 4, "batch": 1, "settle_every": 0, "settle_time": 0.0},
+    "steady": {"cps": 120, "min_cps": 30, "max_cps": 200, "break_cost": 4, "batch": 1, "settle_every": 200, "settle_time": 0.05},
+    "fast": {"cps": 600, "min_cps": 60, "max_cps": 2000, "break_cost": 8, "batch": 32, "settle_every": 500, "settle_time": 0.1},
+}
+DEFAULT_PROFILE = os.getenv("CLIP_TO_TYPE_PROFILE", "steady")
+# Longest a pacing wait sleeps before checking for cancellation again
+CANCEL_CHECK_INTERVAL = 0.05
+
+
+class CancelFlag:
+    '''
+    Cancellation flag that is safe to set from a signal handler. Setting it is a plain attribute write,
+    whereas threading.Event.set takes the Event's lock, which the interrupted thread may be holding
+    inside Event.wait (a deadlock). Waits sleep in short slices and check the flag in between.
+    '''
+    def __init__(self):
+        self.cancelled = False
+
+    def set(self):
+        self.cancelled = True
+
+    def is_set(self) -> bool:
+        return self.cancelled
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.perf_counter() + timeout
+        while not self.cancelled:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, CANCEL_CHECK_INTERVAL))
+        return self.cancelled
+
+
+class TypingPacer:
+    '''
+    Rate model for typing: each unit of text costs a number of characters and the pacer waits so the
+    average rate stays at `cps`. A key send that takes much longer than its time slot means the input
+    queue is backing up, so the rate is cut multiplicatively and recovered gradually afterwards.
+    '''
+    SLOW_SEND_FACTOR = 2.0
+    SLOWDOWN = 0.7
+    SPEEDUP = 1.1
+    RECOVER_AFTER = 50
+
+    def __init__(self, cps, min_cps, max_cps, settle_every=0, settle_time=0.0, cancel_flag=None):
+        self.cps = cps
+        self.min_cps = min_cps
+        self.max_cps = max_cps
+        self.settle_every = settle_every
+        self.settle_time = settle_time
+        self.cancel_flag = cancel_flag or CancelFlag()
+        self.good_sends = 0
+        self.slowdowns = 0
+        self.since_settle = 0
+
+    def pace(self, cost: int, send_time: float) -> bool:
+        """
+        Wait out the time slot of a unit that took `send_time` to send. Returns False once cancelled.
+        """
+        slot = cost / self.cps
+        if send_time > max(slot * self.SLOW_SEND_FACTOR, 0.002):
+            self.cps = max(self.min_cps, self.cps * self.SLOWDOWN)
+            self.good_sends = 0
+            self.slowdowns += 1
+        else:
+            self.good_sends += 1
+            if self.good_sends >= self.RECOVER_AFTER:
+                self.cps = min(self.max_cps, self.cps * self.SPEEDUP)
+                self.good_sends = 0
+        delay = max(0.0, slot - send_time)
+        self.since_settle += cost
+        if self.settle_every and self.since_settle >= self.settle_every:
+            self.since_settle = 0
+            delay += self.settle_time
+        if delay > 0:
+            return not self.cancel_flag.wait(delay)
+        return not self.cancel_flag.is_set()
+
+
+def typing_units(text: str, batch: int = 1):
+    """
+    Split text into units to send: a named key for special characters, otherwise runs of up to
+    `batch` plain characters (with batching, spaces are typed as part of the run).
+    """
+    run = []
     for char in text:
-        default_delay = 0.01  # Default delay between key presses
-        extra_delay = 0.0
-        if char == '\r' or char == '\x00' or char == '\x0b' or char == '\x0c':
-            # Ignored characters: 
-            #   \r (carriage return),
-            #   \x00 (null character),
-            #   \x0b (vertical tab),
-            #   \x0c (form feed),
+        if char in IGNORED_CHARS:
             continue
-        elif char == '\n':
-            kb.press(keyboard.Key.enter)
-            kb.release(keyboard.Key.enter)
-            extra_delay = 0.05
-        elif char == '\t':
-            kb.press(keyboard.Key.tab)
-            kb.release(keyboard.Key.tab)
-            extra_delay = 0.05
-        elif char == ' ':
-            kb.press(keyboard.Key.space)
-            kb.release(keyboard.Key.space)
-            extra_delay = 0.05
+        if char in SPECIAL_KEYS and (batch == 1 or char != ' '):
+            if run:
+                yield "".join(run)
+                run = []
+            yield SPECIAL_KEYS[char]
+            continue
+        run.append(char)
+        if len(run) >= batch:
+            yield "".join(run)
+            run = []
+    if run:
+        yield "".join(run)
+
+
+class TypingEngine:
+    '''
+    Types text through pynput at a paced rate. Cancelling (e.g. from a SIGTERM handler) stops it
+    between units, and any keys still held are released before returning.
+    '''
+    def __init__(self, profile: str = DEFAULT_PROFILE, cancel_flag: CancelFlag = None, controller=None):
+        if profile not in RATE_PROFILES:
+            raise ValueError(f"Unknown typing profile: {profile}")
+        self.profile = profile
+        self.config = RATE_PROFILES[profile]
+        self.cancel_flag = cancel_flag or CancelFlag()
+        self.kb = controller or keyboard.Controller()
+        self.held = set()
+
+    def send(self, unit):
+        if isinstance(unit, keyboard.Key) or len(unit) == 1:
+            self.held.add(unit)
+            self.kb.press(unit)
+            self.kb.release(unit)
+            self.held.discard(unit)
         else:
-            # For other characters, just type them directly
-            kb.press(char)
-            kb.release(char)
-        time.sleep(default_delay + extra_delay)
+            self.kb.type(unit)
+
+    def release_all(self):
+        with self.kb.modifiers as modifiers:
+            stuck = self.held | set(modifiers)
+        for key in stuck:
+            try:
+                self.kb.release(key)
+            except Exception as e:
+                logger.log(f"Failed to release key {key}: {e}")
+        self.held.clear()
+
+    def type_text(self, text: str) -> dict:
+        config = self.config
+        pacer = TypingPacer(config["cps"], config["min_cps"], config["max_cps"], config["settle_every"], config["settle_time"], self.cancel_flag)
+        typed = 0
+        start_time = time.perf_counter()
+        cancelled = False
+        try:
+            for unit in typing_units(text, config["batch"]):
+                if self.cancel_flag.is_set():
+                    cancelled = True
+                    break
+                send_start = time.perf_counter()
+                self.send(unit)
+                send_time = time.perf_counter() - send_start
+                chars = len(unit) if isinstance(unit, str) else 1
+                typed += chars
+                cost = config["break_cost"] if unit in (keyboard.Key.enter, keyboard.Key.tab) else chars
+                if not pacer.pace(cost, send_time):
+                    cancelled = True
+                    break
+        finally:
+            self.release_all()
+        elapsed = time.perf_counter() - start_time
+        return {
+            "profile": self.profile,
+            "chars": typed,
+            "total_chars": len(text),
+            "seconds": round(elapsed, 2),
+            "chars_per_sec": round(typed / elapsed, 1) if elapsed > 0 else None,
+            "final_cps": round(pacer.cps, 1),
+            "slowdowns": pacer.slowdowns,
+            "cancelled": cancelled,
+        }
+
+
+def run_clip_to_type(profile: str = None):
+    # Retrieve text from clipboard and type it at the profile's rate.
+    text = pyperclip.paste()
+    profile = profile or DEFAULT_PROFILE
+    logger.log(f"Typing clipboard text. Length: {len(text)} chars, profile: {profile}")
+    cancel_flag = CancelFlag()
+
+    # Pressing the hotkey again terminates this process; stop between keys instead of mid-keystroke
+    def on_terminate(signum, frame):
+        cancel_flag.set()
+    signal.signal(signal.SIGTERM, on_terminate)
+
+    stats = TypingEngine(profile, cancel_flag).type_text(text)
+    logger.record_metric("clip_to_type", **stats)
+    logger.log(f"Typed {stats['chars']}/{stats['total_chars']} chars in {stats['seconds']} s ({stats['chars_per_sec']} chars/sec)" + (" - cancelled" if stats["cancelled"] else ""))
@@ -5,24 +5,71 @@ import os
 import threading
 import platform
 import requests
-import tempfile
-import shutil
 import webbrowser
 import pyperclip  # Ensure you have this library installed
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import Callable
 
-from utils import copy_image_to_clipboard
+from utils import copy_image_bytes_to_clipboard
 import logger
+from lazyload import lazy_import
 
 # Docs: https://docs.pushbullet.com/
+# Both URLs can be pointed at local stand-in servers for testing
+PUSHBULLET_API_URL = os.getenv("PUSHBULLET_API_URL", "https://api.pushbullet.com")
+PUSHBULLET_STREAM_URL = os.getenv("PUSHBULLET_STREAM_URL", "wss://stream.pushbullet.com/websocket")
+
+# The stream sends a "nop" every 30 seconds; a silent connection past this is considered dead
+STREAM_RECV_TIMEOUT = 45
+STREAM_MIN_BACKOFF = 1
+STREAM_MAX_BACKOFF = 60
+# Consecutive stream failures before falling back to polling for a while
+STREAM_MAX_FAILURES = 3
+STREAM_FALLBACK_INTERVAL = 5 * 60
+
+# Polling backs off while idle and snaps back to the minimum after activity
+POLL_MIN_INTERVAL = 3
+POLL_MAX_INTERVAL = 60
+POLL_IDLE_FACTOR = 1.5
+PUSHES_PAGE_SIZE = 20
+REQUEST_TIMEOUT = 30
+# Log request stats every this many requests (and on every non-200 response)
+REQUEST_LOG_EVERY = 50
+
+# File pushes download on a bounded pool so the listener never waits for them
+DOWNLOAD_WORKERS = 2
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOADS_DIR = os.path.expanduser('~/Downloads')
+
+session = None
+download_executor = None
+
+def get_session() -> requests.Session:
+    """
+    Shared keep-alive session, so polls reuse one TLS connection instead of a new handshake each time.
+    """
+    global session
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
 
 class PushbulletWrapper:
-    def __init__(self, config_path):
+    def __init__(self, config_path, api_url=PUSHBULLET_API_URL, stream_url=PUSHBULLET_STREAM_URL):
         assert config_path is not None, "PushbulletWrapper 'config_path' cannot be None"
         self.config_path = config_path
+        self.api_url = api_url
+        self.stream_url = stream_url
         self.api_key = None
         self.device = None
+        self.request_count = 0
+        self.request_seconds = 0.0
+        # Extra wait requested by the server's rate-limit headers
+        self.rate_limit_delay = 0
         self.load_config()
 
     def load_config(self):
@@ -41,21 +88,58 @@ class PushbulletWrapper:
         with open(self.config_path, 'w') as f:
             json.dump({'api_key': self.api_key, 'device': self.device}, f)
 
+    def request(self, method, path, **kwargs):
+        headers = {'Access-Token': self.api_key, **kwargs.pop('headers', {})}
+        start_time = time.perf_counter()
+        response = get_session().request(method, f'{self.api_url}{path}', headers=headers, timeout=REQUEST_TIMEOUT, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        self.request_count += 1
+        self.request_seconds += elapsed
+        self.update_rate_limit(response)
+        if response.status_code != 200 or self.request_count % REQUEST_LOG_EVERY == 0:
+            logger.log(
+                f"Pushbullet {method} {path} -> {response.status_code} in {elapsed * 1000:.0f} ms "
+                f"(requests: {self.request_count}, mean {self.request_seconds / self.request_count * 1000:.0f} ms)"
+            )
+        return response
+
+    def update_rate_limit(self, response):
+        now = time.time()
+        remaining = response.headers.get('X-Ratelimit-Remaining')
+        limit = response.headers.get('X-Ratelimit-Limit')
+        reset = response.headers.get('X-Ratelimit-Reset')
+        self.rate_limit_delay = 0
+        try:
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After')
+                if retry_after is not None:
+                    self.rate_limit_delay = float(retry_after)
+                elif reset is not None:
+                    self.rate_limit_delay = max(float(reset) - now, POLL_MIN_INTERVAL)
+                else:
+                    self.rate_limit_delay = POLL_MAX_INTERVAL
+            elif remaining is not None and limit is not None and reset is not None and int(remaining) < int(limit) * 0.1:
+                # Spread the remaining quota over the time left until it resets
+                self.rate_limit_delay = max(float(reset) - now, 0) / max(int(remaining), 1)
+        except ValueError:
+            pass
+        if self.rate_limit_delay:
+            logger.log(f"Pushbullet rate limited, waiting at least {self.rate_limit_delay:.0f} s between polls")
+
     def create_device(self):
-        headers = {'Access-Token': self.api_key, 'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json'}
         device_data = {
             "nickname": platform.node() + "-" + datetime.now().strftime("%m%d%y"),
             # "type": "stream",
             "model": "SelfAutomate",
             "manufacturer": "Shantanu"
         }
-        response = requests.post('https://api.pushbullet.com/v2/devices', headers=headers, data=json.dumps(device_data))
+        response = self.request('POST', '/v2/devices', headers=headers, data=json.dumps(device_data))
         response.raise_for_status()
         return response.json()
 
     def get_devices(self):
-        headers = {'Access-Token': self.api_key}
-        response = requests.get('https://api.pushbullet.com/v2/devices', headers=headers)
+        response = self.request('GET', '/v2/devices')
         response.raise_for_status()
         return response.json().get('devices', [])
     
@@ -67,32 +151,118 @@ class PushbulletWrapper:
         logger.access_runtime_config("pushbullet_last_push_timestamp.json", {'ts': ts} )
         return ts
     
+    def fetch_new_pushes(self, callback: Callable, last_timestamp):
+        """
+        Pass pushes for this device modified after `last_timestamp` to `callback`, following the
+        cursor until every pending page is drained.
+        Returns the new last timestamp and the number of pushes received.
+        Nothing is handled unless the drain completes: pages are newest first, so handling a partial
+        drain would move `last_timestamp` past older pushes that were never fetched.
+        """
+        params = {'modified_after': last_timestamp, 'active': 'true', 'limit': PUSHES_PAGE_SIZE}
+        pushes = []
+        while True:
+            response = self.request('GET', '/v2/pushes', params=params)
+            if response.status_code != 200:
+                if pushes:
+                    logger.log(f"Pushbullet drain stopped after {len(pushes)} pushes, retrying from {last_timestamp} on the next poll")
+                return last_timestamp, 0
+            page = response.json()
+            pushes.extend(page.get('pushes', []))
+            cursor = page.get('cursor')
+            if not cursor:
+                break
+            params = {**params, 'cursor': cursor}
+        if pushes:
+            # Pages are newest first, handle oldest first
+            for push in reversed(pushes):
+                if push.get('target_device_iden') == self.device['iden']:
+                    callback(push)
+                    last_timestamp = push.get('modified')
+            self.access_last_push_timestamp(last_timestamp)
+        return last_timestamp, len(pushes)
+
     def listen(self, callback: Callable, wait_interval=60*60*12):
-        headers = {'Access-Token': self.api_key}
-        url = 'https://api.pushbullet.com/v2/pushes'
         try:
             last_timestamp = self.access_last_push_timestamp()
             loop_time = time.time()
+            interval = POLL_MIN_INTERVAL
             # Wait for interval since the last timestamp - 12 hrs by default
             while time.time()-loop_time < wait_interval:
-                params = {'modified_after': last_timestamp, 'active': 'true', 'limit': 10}
-                response = requests.get(url, headers=headers, params=params)
-                if response.status_code == 200:
-                    pushes = response.json().get('pushes', [])
-                    if pushes:
-                        for push in reversed(pushes):
-                            if push.get('target_device_iden') == self.device['iden']:
-                                callback(push)
-                                last_timestamp = push.get('modified')
-                        self.access_last_push_timestamp(last_timestamp)
+                try:
+                    last_timestamp, received = self.fetch_new_pushes(callback, last_timestamp)
+                    if received:
                         loop_time = time.time()
-                time.sleep(3)  # Polling
+                        interval = POLL_MIN_INTERVAL
+                    else:
+                        interval = min(interval * POLL_IDLE_FACTOR, POLL_MAX_INTERVAL)
+                except requests.RequestException as e:
+                    interval = min(interval * 2, POLL_MAX_INTERVAL)
+                    logger.log(f"Pushbullet poll failed, retrying in {interval:.0f} s: {e}")
+                time.sleep(max(interval, self.rate_limit_delay))  # Polling
         except Exception as e:
             logger.log_error(e, f"Error in Pushbullet listen: {e}")
         finally:
             logger.log("Pushbullet listen ended!")
         return None
 
+    def listen_realtime(self, callback: Callable, wait_interval=60*60*12):
+        """
+        Listen on Pushbullet's event stream and fetch pushes only when a "tickle" arrives.
+        Reconnects with exponential backoff, and polls for a while when the stream keeps failing
+        (or the websocket-client package is missing).
+        """
+        try:
+            websocket = lazy_import("websocket")
+        except ImportError:
+            logger.log("websocket-client not installed, falling back to Pushbullet polling")
+            return self.listen(callback, wait_interval)
+
+        loop_time = time.time()
+        backoff = STREAM_MIN_BACKOFF
+        failures = 0
+        try:
+            last_timestamp = self.access_last_push_timestamp()
+            while time.time()-loop_time < wait_interval:
+                if failures >= STREAM_MAX_FAILURES:
+                    logger.log(f"Pushbullet stream unavailable, polling for {STREAM_FALLBACK_INTERVAL} s")
+                    self.listen(callback, STREAM_FALLBACK_INTERVAL)
+                    last_timestamp = self.access_last_push_timestamp()
+                    failures = 0
+                    continue
+                ws = None
+                try:
+                    ws = websocket.create_connection(f"{self.stream_url}/{self.api_key}", timeout=STREAM_RECV_TIMEOUT)
+                    logger.log("Pushbullet stream connected")
+                    backoff = STREAM_MIN_BACKOFF
+                    failures = 0
+                    # Catch up on anything pushed while disconnected
+                    last_timestamp, received = self.fetch_new_pushes(callback, last_timestamp)
+                    if received:
+                        loop_time = time.time()
+                    while time.time()-loop_time < wait_interval:
+                        raw_message = ws.recv()
+                        if not raw_message:
+                            raise websocket.WebSocketConnectionClosedException("Pushbullet stream closed")
+                        message = json.loads(raw_message)
+                        if message.get('type') == 'tickle' and message.get('subtype') == 'push':
+                            last_timestamp, received = self.fetch_new_pushes(callback, last_timestamp)
+                            if received:
+                                loop_time = time.time()
+                except (websocket.WebSocketException, requests.RequestException, OSError, ValueError) as e:
+                    failures += 1
+                    logger.log(f"Pushbullet stream error ({failures}/{STREAM_MAX_FAILURES}), reconnecting in {backoff} s: {e}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, STREAM_MAX_BACKOFF)
+                finally:
+                    if ws is not None:
+                        ws.close()
+        except Exception as e:
+            logger.log_error(e, f"Error in Pushbullet realtime listen: {e}")
+        finally:
+            logger.log("Pushbullet realtime listen ended!")
+        return None
+
 def handle_push(push):
     push_type = push.get('type')
     if push_type == 'note':
@@ -104,26 +274,82 @@ def handle_push(push):
         webbrowser.open(url)
         logger.log(f"Link opened in browser: {url}")
     elif push_type == 'file':
-        file_url = push.get('file_url', '')
-        response = requests.get(file_url, stream=True)
-        if response.status_code == 200:
-            with tempfile.NamedTemporaryFile(delete=False, prefix='SelfAutomate.app_pushbullet_') as tmp_file:
-                shutil.copyfileobj(response.raw, tmp_file)
-                tmp_file_path = tmp_file.name
-            
-            if push.get('file_type', '').startswith('image/'):
-                # Copy the image to clipboard
-                copy_image_to_clipboard(tmp_file_path)
-                logger.log(f"Image copied to clipboard!")
-            else:
-                # Copy the file to downloads folder
-                file_name = push.get('file_name', 'downloaded_file')
-                downloads_path = os.path.join(os.path.expanduser('~/Downloads'), file_name)
-                shutil.copy(tmp_file_path, downloads_path)
-                logger.log(f"File downloaded: {downloads_path}")
-            os.remove(tmp_file_path)
-        else:
+        submit_download(push)
+
+
+def get_download_executor() -> ThreadPoolExecutor:
+    global download_executor
+    if download_executor is None:
+        download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="pushbullet-download")
+    return download_executor
+
+def submit_download(push):
+    def log_failure(future):
+        if future.exception() is not None:
+            logger.log_error(future.exception(), f"Failed to handle file push: {push.get('file_name')}")
+    future = get_download_executor().submit(handle_file_push, push)
+    future.add_done_callback(log_failure)
+    return future
+
+def handle_file_push(push):
+    file_url = push.get('file_url', '')
+    file_type = push.get('file_type', '')
+    if file_type.startswith('image/'):
+        # Images go straight from memory to the clipboard
+        start_time = time.perf_counter()
+        response = get_session().get(file_url, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
             logger.log(f"Failed to get image: {file_url}")
+            return
+        copy_image_bytes_to_clipboard(response.content, file_type)
+        log_throughput("Image copied to clipboard", len(response.content), time.perf_counter() - start_time)
+    else:
+        file_name = os.path.basename(push.get('file_name') or 'downloaded_file')
+        download_file(file_url, os.path.join(DOWNLOADS_DIR, file_name), part_id=push.get('iden'))
+
+def log_throughput(message, size, seconds):
+    logger.log(f"{message}: {size / 1024:.0f} KB in {seconds:.2f} s ({size / 2**20 / max(seconds, 1e-6):.2f} MB/s)")
+
+def download_file(url, destination, attempts=DOWNLOAD_ATTEMPTS, part_id=None):
+    """
+    Stream `url` into `destination` through a `.part` file that is renamed into place once its
+    size is verified. Interrupted transfers resume from the partial file with a Range request.
+    `part_id` (the push iden) names the partial file, so a push never resumes from another push's
+    partial download of a file with the same name.
+    """
+    part_path = f"{destination}.{part_id}.part" if part_id else destination + '.part'
+    start_time = time.perf_counter()
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with get_session().get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                if response.status_code == 416:
+                    # The partial file is already complete (or stale); start over to be safe
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # The server ignored the Range header, so the body is the whole file
+                    offset = 0
+                content_length = response.headers.get('Content-Length')
+                # Content-Length describes the encoded body, so only trust it for identity transfers
+                expected_size = offset + int(content_length) if content_length is not None and 'Content-Encoding' not in response.headers else None
+                with open(part_path, 'ab' if offset else 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+        except requests.RequestException as e:
+            logger.log(f"Download interrupted (attempt {attempt}/{attempts}), resuming: {e}")
+            continue
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            logger.log(f"Download size mismatch for {destination}: {size} of {expected_size} bytes (attempt {attempt}/{attempts})")
+            continue
+        os.replace(part_path, destination)
+        log_throughput(f"File downloaded: {destination}", size, time.perf_counter() - start_time)
+        return destination
+    logger.log(f"Failed to download {url} after {attempts} attempts, partial file kept at {part_path}")
+    return None
 
 # pb = PushbulletWrapper()
 # pb_thread = pb.listen_push_notifications(handle_push)
@@ -134,6 +360,7 @@ def run_pushbullet():
     pb_config_path = os.getenv("PUSHBULLET_CONFIG_PATH")
     if pb_config_path is not None:
         pb = PushbulletWrapper(config_path=pb_config_path)
-        pb.listen(handle_push, 60)
+        # An idle stream costs nothing, so listen for the default interval instead of polling for a minute
+        pb.listen_realtime(handle_push)
     else:
         print("Warning: PUSHBULLET_CONFIG_PATH not set in environment variables. Skipping Pushbullet startup!")
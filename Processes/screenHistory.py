@@ -0,0 +1,291 @@
+'''
+Background screen history: periodically captures the screen, OCRs only the regions that changed
+and indexes the text in a SQLite FTS5 database under LOG_DIR for fast search.
+
+Search from a shell with: python -m Processes.screenHistory <query>
+'''
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import logger
+import tracing
+from lazyload import lazy_import
+
+HISTORY_DB_FILE = "screen_history.db"
+CAPTURE_INTERVAL = float(os.getenv("SCREEN_HISTORY_INTERVAL", 5.0))
+# Command used for OCR (a key of ModelClients.COMMANDS_MAP); the local model keeps screen contents on this machine
+OCR_COMMAND = os.getenv("SCREEN_HISTORY_COMMAND", "DETECT_TEXT_LOCAL")
+OCR_TIMEOUT = 120
+RETENTION_DAYS = 7
+MAX_SNIPPETS = 50_000
+PRUNE_INTERVAL = 60 * 60
+
+# Change detection works on a grayscale thumbnail split into blocks; pixel values are quantized
+# to 16 levels so compression noise and anti-aliasing jitter don't count as change
+THUMBNAIL_WIDTH = 256
+BLOCK_SIZE = 16
+QUANTIZE_SHIFT = 4
+# Ignore changes smaller than this fraction of the screen (cursor, clock, blinking caret)
+MIN_CHANGED_FRACTION = 0.01
+# Above this fraction the whole frame is OCR'd in one call
+FULL_FRAME_FRACTION = 0.5
+MAX_REGIONS = 6
+# OCR once the screen has been still for a capture, or when changes have been pending this long
+MAX_PENDING_SECONDS = 30
+
+
+def block_hashes(thumbnail) -> list:
+    """
+    Hash of every BLOCK_SIZE x BLOCK_SIZE block of a quantized grayscale thumbnail, row by row.
+    """
+    width, height = thumbnail.size
+    pixels = thumbnail.tobytes()
+    hashes = []
+    for block_top in range(0, height, BLOCK_SIZE):
+        for block_left in range(0, width, BLOCK_SIZE):
+            digest = hashlib.blake2b(digest_size=8)
+            for y in range(block_top, min(block_top + BLOCK_SIZE, height)):
+                digest.update(pixels[y * width + block_left:y * width + min(block_left + BLOCK_SIZE, width)])
+            hashes.append(digest.digest())
+    return hashes
+
+
+def changed_regions(changed: set, columns: int, rows: int, max_regions: int = MAX_REGIONS) -> list:
+    """
+    Group changed block indexes into connected areas. Returns bounding boxes in block units
+    (left, top, right, bottom); too many areas are merged into one box around all of them.
+    """
+    remaining = set(changed)
+    boxes = []
+    while remaining:
+        stack = [remaining.pop()]
+        left, top, right, bottom = columns, rows, 0, 0
+        while stack:
+            index = stack.pop()
+            row, column = divmod(index, columns)
+            left, top, right, bottom = min(left, column), min(top, row), max(right, column + 1), max(bottom, row + 1)
+            for neighbour_row, neighbour_column in ((row - 1, column), (row + 1, column), (row, column - 1), (row, column + 1)):
+                neighbour = neighbour_row * columns + neighbour_column
+                if 0 <= neighbour_row < rows and 0 <= neighbour_column < columns and neighbour in remaining:
+                    remaining.remove(neighbour)
+                    stack.append(neighbour)
+        boxes.append((left, top, right, bottom))
+    if len(boxes) > max_regions:
+        boxes = [(min(box[0] for box in boxes), min(box[1] for box in boxes), max(box[2] for box in boxes), max(box[3] for box in boxes))]
+    return boxes
+
+
+class ChangeDetector:
+    '''
+    Tracks which blocks of the screen differ from what was last OCR'd. Changes accumulate against
+    that baseline (so text that appears a little at a time is still picked up once it adds up) and
+    are released once the screen is still, so a burst of activity costs one OCR pass.
+    Released blocks only join the baseline once `commit` confirms their text was stored, so a failed
+    OCR is retried on the next capture.
+    '''
+    def __init__(self):
+        # Block hashes as of the last OCR, and of the previous capture
+        self.hashes = None
+        self.last_hashes = None
+        self.pending_since = None
+        self.columns = self.rows = 0
+
+    def update(self, image):
+        """
+        Feed a captured frame. Returns the set of changed block indexes that are ready to OCR (possibly empty);
+        pass them to `commit` once their text is stored.
+        """
+        Image = lazy_import("PIL.Image")
+        thumbnail_height = max(BLOCK_SIZE, round(image.height * THUMBNAIL_WIDTH / image.width))
+        thumbnail = image.convert("L").resize((THUMBNAIL_WIDTH, thumbnail_height), resample=Image.Resampling.BILINEAR, reducing_gap=2.0)
+        thumbnail = thumbnail.point(lambda value: value >> QUANTIZE_SHIFT)
+        hashes = block_hashes(thumbnail)
+        self.columns = -(-THUMBNAIL_WIDTH // BLOCK_SIZE)
+        self.rows = -(-thumbnail_height // BLOCK_SIZE)
+        if self.hashes is None or len(self.hashes) != len(hashes):
+            # First frame (or a resolution change): everything is new
+            self.hashes = [None] * len(hashes)
+            self.last_hashes = None
+        min_blocks = MIN_CHANGED_FRACTION * len(hashes)
+        changed = {index for index, (old, new) in enumerate(zip(self.hashes, hashes)) if old != new}
+        moving = len(hashes) if self.last_hashes is None else sum(old != new for old, new in zip(self.last_hashes, hashes))
+        self.last_hashes = hashes
+        if len(changed) < min_blocks:
+            # Too little to OCR yet; the baseline is kept so small changes add up
+            self.pending_since = None
+            return set()
+        if self.pending_since is None:
+            self.pending_since = time.time()
+        if moving >= min_blocks and time.time() - self.pending_since < MAX_PENDING_SECONDS:
+            # Still changing: wait for it to settle
+            return set()
+        self.pending_since = None
+        return changed
+
+    def commit(self, blocks: set):
+        """
+        Take `blocks` of the last captured frame into the baseline, once their text has been indexed.
+        """
+        for index in blocks:
+            self.hashes[index] = self.last_hashes[index]
+
+    def regions(self, blocks: set, width: int, height: int) -> list:
+        """
+        Pixel boxes of the screen to OCR for the given changed blocks, as (box, blocks it covers) pairs.
+        """
+        if len(blocks) >= FULL_FRAME_FRACTION * self.columns * self.rows:
+            return [((0, 0, width, height), set(blocks))]
+        scale_x, scale_y = width / self.columns, height / self.rows
+        # Pad by half a block so text cut at a block edge is read whole
+        pad_x, pad_y = scale_x / 2, scale_y / 2
+        regions = []
+        for left, top, right, bottom in changed_regions(blocks, self.columns, self.rows):
+            box = (
+                max(0, int(left * scale_x - pad_x)),
+                max(0, int(top * scale_y - pad_y)),
+                min(width, int(right * scale_x + pad_x)),
+                min(height, int(bottom * scale_y + pad_y)),
+            )
+            covered = {index for index in blocks if left <= index % self.columns < right and top <= index // self.columns < bottom}
+            regions.append((box, covered))
+        return regions
+
+
+class ScreenHistoryIndex:
+    '''
+    Full-text index of OCR'd screen snippets in SQLite FTS5, with bounded retention.
+    '''
+    def __init__(self, db_path=None, retention_days=RETENTION_DAYS, max_snippets=MAX_SNIPPETS):
+        self.db_path = db_path or os.path.join(logger.LOG_DIR, HISTORY_DB_FILE)
+        self.retention_days = retention_days
+        self.max_snippets = max_snippets
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS snippets USING fts5("
+            "text, captured_at UNINDEXED, region UNINDEXED, tokenize='unicode61')"
+        )
+        self.conn.commit()
+        # Hashes of recently stored texts, to skip re-indexing text that reappears unchanged
+        self.recent = OrderedDict()
+        self.last_prune = 0
+
+    def add(self, text: str, region=None, captured_at=None) -> bool:
+        text = text.strip()
+        if not text:
+            return False
+        key = hashlib.blake2b(" ".join(text.split()).encode(), digest_size=16).digest()
+        if key in self.recent:
+            self.recent.move_to_end(key)
+            return False
+        self.recent[key] = None
+        if len(self.recent) > 512:
+            self.recent.popitem(last=False)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO snippets (text, captured_at, region) VALUES (?, ?, ?)",
+                (text, captured_at or time.time(), ",".join(str(value) for value in region) if region else None),
+            )
+            self.conn.commit()
+        if time.time() - self.last_prune > PRUNE_INTERVAL:
+            self.prune()
+        return True
+
+    def prune(self):
+        self.last_prune = time.time()
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM snippets WHERE captured_at < ?", (time.time() - self.retention_days * 24 * 60 * 60,)
+            ).rowcount
+            removed += self.conn.execute(
+                "DELETE FROM snippets WHERE rowid NOT IN (SELECT rowid FROM snippets ORDER BY captured_at DESC LIMIT ?)",
+                (self.max_snippets,),
+            ).rowcount
+            self.conn.commit()
+        if removed:
+            logger.log(f"Screen history pruned {removed} snippets")
+
+    def search(self, query: str, limit: int = 20, raw: bool = False) -> list:
+        """
+        Snippets matching `query`, best match first, as (captured_at, region, highlighted excerpt).
+        Words are matched as given (all must appear); `raw` passes FTS5 query syntax through unchanged.
+        """
+        match = query if raw else " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not match:
+            return []
+        with self.lock:
+            return self.conn.execute(
+                "SELECT captured_at, region, snippet(snippets, 0, '[', ']', '...', 16) "
+                "FROM snippets WHERE snippets MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit),
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def run_screen_history(interval: float = CAPTURE_INTERVAL, command_key: str = OCR_COMMAND, monitor: int = 1):
+    """
+    Capture every `interval` seconds and index the text of regions that changed.
+    Captures are cheap; OCR (CPU or network) only runs for changed regions once the screen settles.
+    """
+    from capture import screen_capture
+    from ModelClients import COMMANDS_MAP, Command
+
+    # One-off screenshots would only evict the interactive commands' cached responses
+    command = Command(**{**COMMANDS_MAP[command_key], "cache": False})
+    index = ScreenHistoryIndex()
+    index.prune()
+    detector = ChangeDetector()
+    logger.log(f"Screen history started: every {interval} s, OCR with {command}")
+    while True:
+        started = time.perf_counter()
+        try:
+            image = screen_capture.grab(monitor=monitor).to_image()
+            blocks = detector.update(image)
+            if blocks:
+                regions = detector.regions(blocks, image.width, image.height)
+                for region, region_blocks in regions:
+                    with tracing.span("history.ocr", region=region):
+                        ocr_start = time.perf_counter()
+                        text = command.invoke_with_image(image.crop(region), copy_to_clipboard=False, timeout=OCR_TIMEOUT)
+                    stored = index.add(text, region)
+                    detector.commit(region_blocks)
+                    logger.record_metric(
+                        "screen_history",
+                        region=list(region),
+                        changed_blocks=len(blocks),
+                        ocr_ms=round((time.perf_counter() - ocr_start) * 1000, 1),
+                        chars=len(text),
+                        stored=stored,
+                    )
+        except Exception as e:
+            logger.log_error(e, "Screen history capture failed")
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def search_history(query: str, limit: int = 20) -> list:
+    index = ScreenHistoryIndex()
+    try:
+        return index.search(query, limit)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m Processes.screenHistory <query>")
+        sys.exit(1)
+    start = time.perf_counter()
+    results = search_history(" ".join(sys.argv[1:]))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for captured_at, region, excerpt in results:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(captured_at))}  [{region}]  {excerpt}")
+    print(f"{len(results)} results in {elapsed_ms:.1f} ms")
@@ -1,17 +1,74 @@
 from typing import List
+import queue
+import threading
 import time
 
 import tkinter as tk
 from tkinter import Canvas, simpledialog
 from PIL import ImageTk, Image
+import pyperclip
 
-from utils import grab_screenshot
-from ModelClients import COMMANDS, Command
+from utils import grab_screenshot, submit_background
+from capture import SharedFrame
+from ModelClients import COMMANDS, Command, run_commands, combine_responses, preload_local_models
+from ModelClients.speculation import start_speculation, get_command_usage
 
 import logger
+import tracing
+
+
+def image_nbytes(image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+def fast_resize(image, size):
+    """
+    Resize for on-screen display only: `reducing_gap` lets PIL shrink by an integer factor
+    before a cheap bilinear pass.
+    """
+    return image.resize(size, resample=Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+class PreviewPyramid:
+    '''
+    Display-resolution copies of a screenshot, built once and reused on every redraw.
+    Level 0 matches the canvas size and each further level halves the previous one.
+    The canvas can have another aspect ratio than the capture, so levels scale each axis separately.
+    '''
+    def __init__(self, image, display_size, levels=1, max_bytes=None):
+        self.source_size = image.size
+        self.levels = [fast_resize(image, display_size)]
+        while len(self.levels) < levels and min(self.levels[-1].size) >= 128:
+            level = self.levels[-1].reduce(2)
+            if max_bytes is not None and self.nbytes + image_nbytes(level) > max_bytes:
+                break
+            self.levels.append(level)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(image_nbytes(level) for level in self.levels)
+
+    def scale(self, level) -> tuple:
+        """
+        (x, y) scale of `level` relative to the source.
+        """
+        return level.width / self.source_size[0], level.height / self.source_size[1]
+
+    def level_for(self, scale: float):
+        """
+        Smallest cached level with at least `scale` of the source resolution on both axes, or None.
+        """
+        candidates = [level for level in self.levels if min(self.scale(level)) >= scale]
+        return min(candidates, key=lambda level: level.width) if candidates else None
+
 
 class ScreenTextTaskApp:
-    def __init__(self, supported_commands: List[str] = COMMANDS):
+    def __init__(self, supported_commands: List[str] = COMMANDS, trigger_time: float = None, memory_budget_mb: int = 512, command_timeout: float = 60, stream_responses: bool = True, max_parallel_commands: int = 3, image=None):
+        self.start_time = time.perf_counter()
+        self.max_parallel_commands = max_parallel_commands
+        self.command_timeout = command_timeout
+        self.stream_responses = stream_responses
+        self.trigger_time = trigger_time
+        self.memory_budget = memory_budget_mb * 2**20
         self.master = tk.Tk()
         self.master.title("Screen Text Task")
         self.supported_commands = supported_commands
@@ -36,10 +93,32 @@ class ScreenTextTaskApp:
         # Hide the root window drag bar and close button
         # self.master.overrideredirect(True)
 
-        self.image = grab_screenshot()
+        # A screenshot taken at trigger time is passed in; otherwise capture now
+        # The source stays at full resolution since every crop sent to the models is cut from it;
+        # the memory budget only bounds the display copies (preview levels and PhotoImage)
+        self.image = image if image is not None else grab_screenshot()
+        self.preview = PreviewPyramid(
+            self.image,
+            (self.window_width, self.window_height),
+            max_bytes=self.memory_budget - self.photo_nbytes(),
+        )
+        self.canvas_photo = None
+        # Work started on the current selection before a command is picked (see ModelClients.speculation)
+        self.speculation = None
         
         self.render_canvas_display()
+        self.master.after_idle(self.log_first_frame)
         
+    def log_first_frame(self):
+        logger.log(f"Time to first paint: {(time.perf_counter() - self.start_time) * 1000:.1f} ms")
+        if self.trigger_time is not None:
+            logger.log(f"Hotkey to first frame: {(time.time() - self.trigger_time) * 1000:.1f} ms")
+            tracing.record_span("first_frame", self.trigger_time)
+
+    def photo_nbytes(self) -> int:
+        # Tk keeps its own 32-bit copy of the canvas preview
+        return self.window_width * self.window_height * 4
+
     def mainloop(self):
         self.master.mainloop()
 
@@ -49,15 +128,17 @@ class ScreenTextTaskApp:
     
     def render_canvas_display(self):
         self.clear_widgets()
+        self.cancel_speculation()
         
         window_width = self.window_width
         window_height = self.window_height
         self.master.geometry(f"{window_width}x{window_height}+{self.padding_width}+{self.padding_height}")
         
-        display_image = self.image.resize((window_width, window_height),resample=Image.Resampling.LANCZOS)
+        # The preview and its PhotoImage are built once and reused by "Retry Selection"
+        if self.canvas_photo is None:
+            self.canvas_photo = ImageTk.PhotoImage(self.preview.levels[0])
         self.canvas = Canvas(self.master, width=window_width, height=window_height)
-        self.photo = ImageTk.PhotoImage(display_image)
-        self.canvas.create_image(0, 0, anchor='nw', image=self.photo)
+        self.canvas.create_image(0, 0, anchor='nw', image=self.canvas_photo)
         self.canvas.pack()
         
         self.rect = None
@@ -82,28 +163,36 @@ class ScreenTextTaskApp:
                 y1, y2 = y2, y1
 
             if x2 - x1 < 10 or y2 - y1 < 10:
-                self.render_prompt_window(self.image)
+                cropped_image, crop_box = self.image, (0, 0, self.image.width, self.image.height)
             else:
                 x1 = int(x1 / window_width * self.image.width)
                 x2 = int(x2 / window_width * self.image.width)
                 y1 = int(y1 / window_height * self.image.height)
                 y2 = int(y2 / window_height * self.image.height)
-                cropped_image = self.image.crop((x1, y1, x2, y2))
-                self.render_prompt_window(cropped_image)
+                cropped_image, crop_box = self.image.crop((x1, y1, x2, y2)), (x1, y1, x2, y2)
+            # Encode (and maybe run the likely command) while the user reads the buttons
+            self.speculation = start_speculation(cropped_image, self.supported_commands, timeout=self.command_timeout)
+            self.render_prompt_window(cropped_image, crop_box)
         
         self.canvas.bind("<ButtonPress-1>", on_button_press)
         self.canvas.bind("<B1-Motion>", on_move_press)
         self.canvas.bind("<ButtonRelease-1>", on_button_release)
         
     
-    def render_prompt_window(self, cropped_image):
+    def render_prompt_window(self, cropped_image, crop_box):
         self.clear_widgets()
 
-        display_image_width = int(cropped_image.width * (self.screen_width / self.image.width))
-        display_image_height = int(cropped_image.height * (self.screen_height / self.image.height))
+        # The crop is shown at screen scale, shrunk to fit the window; shrunk crops can be cut from a cached preview level
+        display_scale = min(
+            self.screen_width / self.image.width,
+            (self.window_width - 50) / max(cropped_image.width, 1),
+            (self.window_height - 50) / max(cropped_image.height, 1),
+        )
+        display_image_width = int(cropped_image.width * display_scale)
+        display_image_height = int(cropped_image.height * display_scale)
         
         window_width = max(min(int(display_image_width + 50), self.window_width), 300)
-        window_height = min(int(display_image_height + 50), self.window_height) + len(self.supported_commands) * 50
+        window_height = min(int(display_image_height + 50), self.window_height) + (len(self.supported_commands) + 1) * 50
         padding_width = int(self.screen_width/2 - window_width/2)
         padding_height = int(self.screen_height/2 - window_height/2)
         self.master.geometry(f"{window_width}x{window_height}+{padding_width}+{padding_height}")
@@ -113,40 +202,229 @@ class ScreenTextTaskApp:
 
         def get_model_command_callback(command: Command):
             def on_command_click():
-                logger.log(f"Running ScreenTask: {command}")
-                self.clear_widgets()
-                self.master.title("Running...")
-                self.master.geometry(f"300x0+{int(self.screen_width/2 - 300/2)}+{int(self.screen_height/2 - 0/2)}")
-                self.master.update()
-                try:
-                    # Invoke the model command with the cropped image
-                    command.invoke_with_image(cropped_image)
-                except Exception as e:
-                    logger.log_error(e, f"Error invoking command: {command.display_string}")
-                    self.master.title(f"Error")
-                    self.master.update()
-                    time.sleep(2)
-                    self.master.destroy()
-                    raise e
-                self.master.title("Saved to clipboard! 📋")
-                self.master.update()
-                time.sleep(1)
-                self.master.destroy()
+                self.run_command(command, cropped_image)
             return on_command_click
         
+        # Checked commands run together; the clipboard gets their results in the order they were checked
+        selected_commands = []
+        def get_select_callback(command: Command, selected: tk.BooleanVar):
+            def on_select():
+                if selected.get():
+                    selected_commands.append(command)
+                elif command in selected_commands:
+                    selected_commands.remove(command)
+            return on_select
+
         for command in self.supported_commands:
-            button = tk.Button(self.master, text=command, command=get_model_command_callback(command))
-            button.pack(pady=3)
+            row = tk.Frame(self.master)
+            row.pack(pady=3)
+            selected = tk.BooleanVar(row, value=False)
+            tk.Checkbutton(row, variable=selected, command=get_select_callback(command, selected)).pack(side="left")
+            button = tk.Button(row, text=command, command=get_model_command_callback(command))
+            button.pack(side="left")
 
-        display_image = cropped_image.resize((display_image_width, display_image_height),resample=Image.Resampling.LANCZOS)
+        def on_run_selected():
+            if selected_commands:
+                self.run_selected_commands(list(selected_commands), cropped_image)
+        button = tk.Button(self.master, text="Run selected", command=on_run_selected)
+        button.pack(pady=3)
+
+        # Crop from a cached preview level when it has enough resolution, otherwise from the source
+        level = self.preview.level_for(display_image_width / max(cropped_image.width, 1))
+        if level is not None:
+            scale_x, scale_y = self.preview.scale(level)
+            left, top, right, bottom = crop_box
+            display_source = level.crop((int(left * scale_x), int(top * scale_y), int(right * scale_x), int(bottom * scale_y)))
+        else:
+            display_source = cropped_image
+        display_image = fast_resize(display_source, (max(display_image_width, 1), max(display_image_height, 1)))
         photo = ImageTk.PhotoImage(display_image)
         panel = tk.Label(self.master, image=photo)
         panel.photo = photo
         panel.pack(side="top", fill="none", expand="yes")
 
+    def cancel_speculation(self):
+        if self.speculation is not None:
+            self.speculation.cancel()
+            self.speculation = None
+
+    def run_command(self, command: Command, cropped_image):
+        """
+        Run the model command on a background thread while the Tk loop keeps running,
+        showing elapsed time, the response as it streams in, and a Cancel button.
+        A speculative call already running for this command is taken over instead of starting a new one.
+        """
+        logger.log(f"Running ScreenTask: {command}")
+        submit_background(get_command_usage().record_pick, command)
+        self.clear_widgets()
+        self.master.title("Running...")
+        window_width, window_height = (600, 400) if self.stream_responses else (300, 80)
+        self.master.geometry(f"{window_width}x{window_height}+{int(self.screen_width/2 - window_width/2)}+{int(self.screen_height/2 - window_height/2)}")
+        status = tk.Label(self.master, text="Running...")
+        status.pack(pady=3)
+
+        start_time = time.perf_counter()
+        cancel_event = threading.Event()
+        # Streamed text is handed from the request thread to the Tk thread through a queue
+        tokens = queue.SimpleQueue()
+        response_text = None
+        if self.stream_responses:
+            response_text = tk.Text(self.master, wrap="word")
+        speculation, self.speculation = self.speculation, None
+        claimed = speculation.claim(command, on_token=tokens.put if self.stream_responses else None) if speculation is not None else None
+        if claimed is not None:
+            future, cancel_event = claimed
+        else:
+            future = submit_background(
+                lambda: command.invoke_with_image(
+                    cropped_image,
+                    copy_to_clipboard=False,
+                    timeout=self.command_timeout,
+                    on_token=tokens.put if self.stream_responses else None,
+                    cancel_event=cancel_event,
+                    # Waits for the speculative encoding on this thread, not the Tk one
+                    encoded=speculation.encoded_for(command) if speculation is not None else None,
+                )
+            )
+
+        finish = self.finish_task
+
+        def on_cancel():
+            # Streams close on the next chunk; otherwise the request thread is a daemon and ends with the process
+            cancel_event.set()
+            future.cancel()
+            logger.log(f"Cancelled ScreenTask: {command} after {time.perf_counter() - start_time:.1f} s")
+            self.master.destroy()
+
+        def drain_tokens():
+            while not tokens.empty():
+                response_text.insert("end", tokens.get())
+                response_text.see("end")
+
+        def poll():
+            elapsed = time.perf_counter() - start_time
+            if response_text is not None:
+                drain_tokens()
+            if not future.done():
+                if elapsed > self.command_timeout:
+                    cancel_event.set()
+                    logger.log(f"ScreenTask timed out: {command} after {elapsed:.1f} s")
+                    finish("Timed out", 2000)
+                    return
+                status.config(text=f"Running {command}... {elapsed:.1f} s")
+                self.master.after(100, poll)
+                return
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.log_error(e, f"Error invoking command: {command.display_string}")
+                finish("Error", 2000)
+                return
+            # Clipboard access stays on the UI thread
+            with tracing.span("clipboard"):
+                pyperclip.copy(response)
+            tracing.record_span("screen_task", time.time() - elapsed, command=command.display_string)
+            logger.log(f"ScreenTask completed: {command} in {elapsed:.1f} s")
+            finish("Saved to clipboard! 📋", 1000)
+
+        cancel_button = tk.Button(self.master, text="Cancel", command=on_cancel)
+        cancel_button.pack(pady=3)
+        if response_text is not None:
+            response_text.pack(fill="both", expand=True, padx=3, pady=3)
+        self.master.after(100, poll)
+
+    def finish_task(self, title, delay_ms):
+        self.clear_widgets()
+        self.master.geometry(f"300x0+{int(self.screen_width/2 - 300/2)}+{int(self.screen_height/2)}")
+        self.master.title(title)
+        self.master.after(delay_ms, self.master.destroy)
+
+    def run_selected_commands(self, commands: List[Command], cropped_image):
+        """
+        Run several commands concurrently on the same crop, showing each result as it completes.
+        """
+        logger.log(f"Running ScreenTasks: {', '.join(str(command) for command in commands)}")
+        self.cancel_speculation()
+        for command in commands:
+            submit_background(get_command_usage().record_pick, command)
+        self.clear_widgets()
+        self.master.title("Running...")
+        window_width, window_height = 600, 400
+        self.master.geometry(f"{window_width}x{window_height}+{int(self.screen_width/2 - window_width/2)}+{int(self.screen_height/2 - window_height/2)}")
+        status = tk.Label(self.master, text="Running...")
+        status.pack(pady=3)
+
+        start_time = time.perf_counter()
+        cancel_event = threading.Event()
+        finished = queue.SimpleQueue()
+        completed = []
+        future = submit_background(
+            run_commands,
+            commands,
+            cropped_image,
+            max_workers=self.max_parallel_commands,
+            timeout=self.command_timeout,
+            on_result=lambda command, response, error: finished.put((command, response, error)),
+            cancel_event=cancel_event,
+        )
+
+        def on_cancel():
+            cancel_event.set()
+            logger.log(f"Cancelled ScreenTasks after {time.perf_counter() - start_time:.1f} s")
+            self.master.destroy()
+
+        def poll():
+            elapsed = time.perf_counter() - start_time
+            while not finished.empty():
+                command, response, error = finished.get()
+                completed.append(command)
+                results_text.insert("end", f"## {command}\n{response if error is None else f'Error: {error}'}\n\n")
+                results_text.see("end")
+            if not future.done():
+                if elapsed > self.command_timeout:
+                    cancel_event.set()
+                    logger.log(f"ScreenTasks timed out after {elapsed:.1f} s")
+                    self.finish_task("Timed out", 2000)
+                    return
+                status.config(text=f"{len(completed)}/{len(commands)} done... {elapsed:.1f} s")
+                self.master.after(100, poll)
+                return
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.log_error(e, "Error running selected commands")
+                self.finish_task("Error", 2000)
+                return
+            combined = combine_responses(results)
+            if not combined:
+                self.finish_task("Error", 2000)
+                return
+            with tracing.span("clipboard"):
+                pyperclip.copy(combined)
+            self.finish_task("Saved to clipboard! 📋", 1000)
+
+        cancel_button = tk.Button(self.master, text="Cancel", command=on_cancel)
+        cancel_button.pack(pady=3)
+        results_text = tk.Text(self.master, wrap="word")
+        results_text.pack(fill="both", expand=True, padx=3, pady=3)
+        self.master.after(100, poll)
+
 
-def run_screentext_task_ui():
-    app = ScreenTextTaskApp()
+def run_screentext_task_ui(shared_frame: SharedFrame = None, trigger_time: float = None, memory_budget_mb: int = 512, stream_responses: bool = True):
+    """
+    `shared_frame` is the screen captured by the parent when the hotkey was pressed.
+    """
+    image = None
+    if shared_frame is not None:
+        try:
+            # Copies the pixels out and frees the shared block right away
+            image = shared_frame.to_image()
+            logger.log(f"Using screenshot captured {(time.time() - shared_frame.captured_at) * 1000:.1f} ms ago by the parent")
+        except Exception as e:
+            logger.log_error(e, "Could not read the shared screenshot, capturing again")
+    # Load local models while the user is still selecting a region
+    submit_background(preload_local_models)
+    app = ScreenTextTaskApp(trigger_time=trigger_time, memory_budget_mb=memory_budget_mb, stream_responses=stream_responses, image=image)
     app.mainloop()
 
 
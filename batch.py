@@ -0,0 +1,184 @@
+'''
+Headless batch runner: applies model commands to saved images without the UI.
+
+    python batch.py <dir or glob> [...] [--command DETECT_TEXT] [--output results.jsonl] [--workers 4]
+
+Results are appended to the output as JSON lines while they finish. Re-running with the same
+output skips image/command pairs that already succeeded, so an interrupted batch can be resumed.
+'''
+import os
+import sys
+import glob
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import logger
+from lazyload import lazy_import
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+# Latencies kept for the summary percentiles (a uniform sample once there are more)
+LATENCY_SAMPLE_SIZE = 10_000
+
+
+def iter_images(inputs, recursive=False):
+    """
+    Image paths from directories and glob patterns, yielded lazily in a stable order per directory.
+    """
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name)
+                if not recursive:
+                    break
+        else:
+            for path in glob.iglob(pattern, recursive=recursive):
+                if os.path.isfile(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                    yield path
+
+
+def task_key(path, command_key) -> bytes:
+    return hashlib.blake2b(f"{command_key}\0{os.path.abspath(path)}".encode(), digest_size=16).digest()
+
+
+def load_completed(output_path) -> set:
+    """
+    Keys of image/command pairs that already succeeded in a previous run.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interruption
+                continue
+            if record.get("status") == "ok":
+                completed.add(task_key(record["file"], record["command"]))
+    return completed
+
+
+class BatchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ok = 0
+        self.errors = 0
+        self.skipped = 0
+        self.seen = 0
+        self.latencies = []
+
+    def add(self, latency_ms, ok):
+        with self.lock:
+            if ok:
+                self.ok += 1
+            else:
+                self.errors += 1
+            self.seen += 1
+            # Reservoir sampling keeps memory flat however many images there are
+            if len(self.latencies) < LATENCY_SAMPLE_SIZE:
+                self.latencies.append(latency_ms)
+            else:
+                index = random.randrange(self.seen)
+                if index < LATENCY_SAMPLE_SIZE:
+                    self.latencies[index] = latency_ms
+
+    def summary(self, elapsed) -> str:
+        done = self.ok + self.errors
+        lines = [
+            f"Processed {done} ({self.ok} ok, {self.errors} failed, {self.skipped} skipped as done) in {elapsed:.1f} s",
+            f"Throughput: {done / elapsed if elapsed > 0 else 0:.2f} images/s",
+        ]
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            def percentile(fraction):
+                return latencies[min(len(latencies) - 1, int(round(fraction * (len(latencies) - 1))))]
+            lines.append(f"Latency: p50 {percentile(0.5):.0f} ms, p95 {percentile(0.95):.0f} ms, max {latencies[-1]:.0f} ms")
+        return "\n".join(lines)
+
+
+def process_image(command, command_key, path, timeout) -> dict:
+    Image = lazy_import("PIL.Image")
+    start = time.perf_counter()
+    record = {"file": path, "command": command_key}
+    try:
+        with Image.open(path) as opened:
+            image = opened.convert("RGB")
+        record["width"], record["height"] = image.size
+        record["response"] = command.invoke_with_image(image, copy_to_clipboard=False, timeout=timeout)
+        record["status"] = "ok"
+    except Exception as e:
+        logger.log_error(e, f"Batch: {command_key} failed on {path}")
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+
+def run_batch(inputs, command_keys, output_path, workers=4, timeout=60, recursive=False, resume=True) -> BatchStats:
+    """
+    Run each command on each image with at most `workers` calls in flight; only a bounded number
+    of tasks is queued ahead, so memory does not grow with the size of the input.
+    """
+    from ModelClients import COMMANDS_MAP, Command
+    commands = {key: Command(**COMMANDS_MAP[key]) for key in command_keys}
+    completed = load_completed(output_path) if resume else set()
+    stats = BatchStats()
+    slots = threading.BoundedSemaphore(workers * 2)
+    write_lock = threading.Lock()
+    start_time = time.perf_counter()
+
+    with open(output_path, "a") as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        def on_done(future):
+            try:
+                record = future.result()
+                stats.add(record["ms"], record["status"] == "ok")
+                with write_lock:
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                    print(f"[{stats.ok + stats.errors}] {record['status']:<5} {record['ms']:>8.0f} ms  {record['command']}  {record['file']}", flush=True)
+            finally:
+                slots.release()
+
+        try:
+            for path in iter_images(inputs, recursive):
+                for key, command in commands.items():
+                    if task_key(path, key) in completed:
+                        stats.skipped += 1
+                        continue
+                    slots.acquire()
+                    executor.submit(process_image, command, key, path, timeout).add_done_callback(on_done)
+        except KeyboardInterrupt:
+            print("Interrupted: waiting for in-flight images, re-run to resume", flush=True)
+    print(stats.summary(time.perf_counter() - start_time))
+    return stats
+
+
+def main():
+    from ModelClients import COMMANDS_MAP
+    parser = argparse.ArgumentParser(description="Run model commands over saved images")
+    parser.add_argument("inputs", nargs="+", help="Image directories or glob patterns")
+    parser.add_argument("--command", action="append", choices=sorted(COMMANDS_MAP), help="Command key (repeatable, default DETECT_TEXT)")
+    parser.add_argument("--output", default="batch_results.jsonl")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--no-resume", action="store_true", help="Process every image even if already in the output")
+    args = parser.parse_args()
+    stats = run_batch(args.inputs, args.command or ["DETECT_TEXT"], args.output, args.workers, args.timeout, args.recursive, not args.no_resume)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+'''
+Micro-benchmark: full-monitor grab vs region grab.
+Usage (needs a display): python -m benchmarks.capture [iterations]
+'''
+import sys
+import time
+import tracemalloc
+import statistics
+
+from capture import ScreenCapture
+
+
+def measure(label, grab, iterations):
+    timings = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        image = grab()
+        timings.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # PIL pixel storage is allocated outside the Python allocator, so add it explicitly
+    image_bytes = image.width * image.height * len(image.getbands())
+    print(
+        f"{label:<28} p50 {statistics.median(timings):7.2f} ms   max {max(timings):7.2f} ms   "
+        f"python peak {peak / 2**20:6.1f} MB   image {image_bytes / 2**20:6.1f} MB   {image.size}"
+    )
+
+
+def grab_legacy():
+    # Previous implementation: new mss context per call and a full bytes copy of the BGRA buffer
+    import mss
+    from PIL import Image
+    with mss.mss() as sct:
+        sct_img = sct.grab(sct.monitors[1])
+        return Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+
+
+def main(iterations=20):
+    engine = ScreenCapture()
+    monitor = engine.monitors[1]
+    region = (
+        monitor["left"] + monitor["width"] // 4,
+        monitor["top"] + monitor["height"] // 4,
+        monitor["width"] // 2,
+        monitor["height"] // 2,
+    )
+    frame = engine.grab(monitor=1)
+    crop_box = (region[0] - monitor["left"], region[1] - monitor["top"], region[0] - monitor["left"] + region[2], region[1] - monitor["top"] + region[3])
+
+    measure("legacy full grab", grab_legacy, iterations)
+    measure("persistent full grab", lambda: engine.grab(monitor=1).to_image(), iterations)
+    measure("persistent region grab", lambda: engine.grab(region=region).to_image(), iterations)
+    measure("convert crop of full frame", lambda: frame.to_image(crop_box), iterations)
+    engine.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,43 @@
+'''
+Micro-benchmark: per-call cost of logger.log vs the previous open/write/close per call.
+Usage: python -m benchmarks.log_calls [calls]
+'''
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+
+def measure(label, call, calls):
+    timings = []
+    for index in range(calls):
+        start = time.perf_counter()
+        call("benchmark message", index, {"key": "value"})
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(
+        f"{label:<24} p50 {statistics.median(timings):8.2f} us   "
+        f"p99 {timings[int(len(timings) * 0.99)]:8.2f} us   total {sum(timings) / 1000:8.1f} ms"
+    )
+
+
+def main(calls=10000):
+    os.environ["LOG_DIR"] = tempfile.mkdtemp(prefix="log_bench_")
+    import logger
+
+    def log_legacy(*args):
+        # Previous implementation: open, write and close the log file on the calling thread
+        file_path = os.path.join(logger.LOG_DIR, "legacy.log")
+        with open(file_path, "a") as file:
+            print(f"[{logger.PID}][{logger.getCurrentTime()}]:", *args, file=file)
+
+    measure("legacy open per call", log_legacy, calls)
+    measure("buffered logger.log", logger.log, calls)
+    start = time.perf_counter()
+    logger.log_writer.flush(timeout=30)
+    print(f"buffered flush after run  {(time.perf_counter() - start) * 1000:.1f} ms   (logs in {logger.LOG_DIR})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
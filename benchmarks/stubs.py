@@ -0,0 +1,335 @@
+'''
+Offline stand-ins for the benchmark suite and tests: synthetic screenshots, a fake mss source,
+local HTTP servers that mimic the Groq and Ollama chat APIs with a configurable latency, and a
+local Pushbullet (pushes API and event stream).
+'''
+import os
+import json
+import time
+import base64
+import random
+import socket
+import hashlib
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from capture import ScreenCapture
+
+# Common screen resolutions, 1080p up to 5K
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+    "5k": (5120, 2880),
+}
+
+STUB_RESPONSE = "The quick brown fox jumps over the lazy dog. " * 8
+
+
+def synthetic_screenshot(width, height, seed=0):
+    """
+    BGRA pixels resembling a desktop: flat window backgrounds, text-like strokes and a photo-like patch.
+    Flat areas compress well and noisy ones don't, so encoders see a realistic mix.
+    """
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (236, 236, 236))
+    draw = ImageDraw.Draw(image)
+    # Windows with title bars
+    for _ in range(4):
+        left, top = rng.randrange(width // 2), rng.randrange(height // 2)
+        right, bottom = left + rng.randrange(width // 4, width // 2), top + rng.randrange(height // 4, height // 2)
+        draw.rectangle((left, top, right, bottom), fill=(255, 255, 255), outline=(180, 180, 180))
+        draw.rectangle((left, top, right, top + 28), fill=(50, 90, 160))
+        # Lines of "text"
+        for y in range(top + 40, bottom - 10, 18):
+            x = left + 10
+            while x < right - 40:
+                word = rng.randrange(12, 60)
+                draw.rectangle((x, y, min(x + word, right - 10), y + 9), fill=(30, 30, 30))
+                x += word + 8
+    # Photo-like noise patch
+    patch_width, patch_height = width // 5, height // 5
+    noise = Image.frombytes("RGB", (patch_width, patch_height), rng.randbytes(patch_width * patch_height * 3))
+    image.paste(noise, (width - patch_width - 20, height - patch_height - 20))
+    r, g, b = image.split()
+    return Image.merge("RGBA", (b, g, r, Image.new("L", image.size, 255))).tobytes()
+
+
+class FakeShot:
+    def __init__(self, raw, area):
+        self.raw = raw
+        self.left = area["left"]
+        self.top = area["top"]
+        self.width = area["width"]
+        self.height = area["height"]
+
+
+class FakeMSS:
+    '''
+    Minimal mss stand-in with a single monitor backed by a synthetic BGRA screenshot.
+    '''
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = synthetic_screenshot(width, height)
+        monitor = {"left": 0, "top": 0, "width": width, "height": height}
+        self.monitors = [monitor, monitor]
+
+    def grab(self, area):
+        if area["width"] == self.width and area["height"] == self.height:
+            # mss hands out a fresh buffer per grab
+            return FakeShot(bytearray(self.pixels), area)
+        stride = self.width * 4
+        rows = bytearray()
+        for y in range(area["top"], area["top"] + area["height"]):
+            start = y * stride + area["left"] * 4
+            rows += self.pixels[start:start + area["width"] * 4]
+        return FakeShot(rows, area)
+
+    def close(self):
+        pass
+
+
+class FakeScreenCapture(ScreenCapture):
+    def __init__(self, width, height):
+        super().__init__()
+        self.fake = FakeMSS(width, height)
+
+    def _sct(self):
+        return self.fake
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive and chunked streaming, like the real APIs
+    protocol_version = "HTTP/1.1"
+    # Otherwise separate header and body writes stall on delayed ACKs (~40 ms)
+    disable_nagle_algorithm = True
+    latency = 0.0
+    # Pause between streamed chunks
+    chunk_interval = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_lines(self, content_type, lines):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = line.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            if self.chunk_interval:
+                time.sleep(self.chunk_interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class GroqStubHandler(StubHandler):
+    '''
+    Mimics POST /openai/v1/chat/completions, plain and server-sent-event streaming.
+    '''
+    def do_POST(self):
+        body = self.read_body()
+        time.sleep(self.latency)
+        model = body.get("model", "stub")
+        if not body.get("stream"):
+            self.send_json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_RESPONSE}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+            return
+        chunks = [
+            {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            for word in STUB_RESPONSE.split()
+        ]
+        # Groq reports usage on the last chunk
+        chunks[-1]["x_groq"] = {"id": "req-stub", "usage": {"prompt_tokens": 1, "completion_tokens": len(chunks), "total_tokens": 1 + len(chunks)}}
+        self.stream_lines("text/event-stream", [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"])
+
+
+class OllamaStubHandler(StubHandler):
+    '''
+    Mimics POST /api/chat, plain and newline-delimited JSON streaming.
+    '''
+    def do_POST(self):
+        body = self.read_body()
+        time.sleep(self.latency)
+        model = body.get("model", "stub")
+        created_at = "2024-01-01T00:00:00Z"
+        if not body.get("stream", True):
+            self.send_json({"model": model, "created_at": created_at, "message": {"role": "assistant", "content": STUB_RESPONSE}, "done": True, "prompt_eval_count": 1, "eval_count": len(STUB_RESPONSE.split())})
+            return
+        lines = [
+            json.dumps({"model": model, "created_at": created_at, "message": {"role": "assistant", "content": word + " "}, "done": False}) + "\n"
+            for word in STUB_RESPONSE.split()
+        ]
+        lines.append(json.dumps({"model": model, "created_at": created_at, "message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": 1, "eval_count": len(lines)}) + "\n")
+        self.stream_lines("application/x-ndjson", lines)
+
+
+def start_stub_server(handler, latency=0.0, chunk_interval=0.0):
+    """
+    Serve `handler` on a free localhost port in a daemon thread. Returns (server, base_url).
+    """
+    handler = type(handler.__name__, (handler,), {"latency": latency, "chunk_interval": chunk_interval})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"{handler.__name__}-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+STUB_DEVICE_IDEN = "stub-device"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class PushbulletStub:
+    '''
+    Local Pushbullet: GET /v2/pushes (newest first, paged with a cursor) on an HTTP server, and the
+    event stream as a minimal websocket server that sends a push tickle whenever `add_push` is called.
+    Set `accept_stream` to False to refuse stream connections (the handshake gets a 503).
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pushes = []
+        self.clients = []
+        self.accept_stream = True
+        # Counters for tests: API fetches, accepted stream connections and times of every stream attempt
+        self.fetches = 0
+        self.connections = 0
+        self.stream_attempts = []
+        stub = self
+
+        class ApiHandler(StubHandler):
+            def do_GET(self):
+                stub.serve_pushes(self)
+
+        class StreamHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                stub.serve_stream(self.request)
+
+        self.api_server, self.api_url = start_stub_server(ApiHandler)
+        self.stream_server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StreamHandler)
+        self.stream_server.daemon_threads = True
+        threading.Thread(target=self.stream_server.serve_forever, name="PushbulletStub-stream", daemon=True).start()
+        self.stream_url = f"ws://127.0.0.1:{self.stream_server.server_address[1]}/websocket"
+
+    def add_push(self, **fields) -> dict:
+        with self.lock:
+            push = {
+                "iden": f"push-{len(self.pushes) + 1}",
+                "active": True,
+                "type": "note",
+                "target_device_iden": STUB_DEVICE_IDEN,
+                "modified": time.time(),
+                **fields,
+            }
+            self.pushes.append(push)
+            clients = list(self.clients)
+        for client in clients:
+            self.send_message(client, {"type": "tickle", "subtype": "push"})
+        return push
+
+    def drop_stream(self):
+        """
+        Cut every stream connection without a close frame, like a network drop.
+        """
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+    def close(self):
+        self.drop_stream()
+        for server in (self.api_server, self.stream_server):
+            server.shutdown()
+            server.server_close()
+
+    def serve_pushes(self, handler):
+        query = parse_qs(urlsplit(handler.path).query)
+        modified_after = float(query.get("modified_after", ["0"])[0])
+        limit = int(query.get("limit", ["20"])[0])
+        offset = int(query.get("cursor", ["0"])[0])
+        with self.lock:
+            self.fetches += 1
+            pushes = sorted((push for push in self.pushes if push["modified"] > modified_after), key=lambda push: push["modified"], reverse=True)
+        page = pushes[offset:offset + limit]
+        cursor = str(offset + limit) if offset + limit < len(pushes) else None
+        handler.send_json({"pushes": page, "cursor": cursor})
+
+    def serve_stream(self, client):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = client.recv(4096)
+            if not data:
+                return
+            request += data
+        headers = dict(
+            line.split(":", 1) for line in request.decode("latin-1").split("\r\n")[1:] if ":" in line
+        )
+        headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+        with self.lock:
+            self.stream_attempts.append(time.monotonic())
+            accept = self.accept_stream
+        if not accept:
+            client.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return
+        accept_key = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest()).decode()
+        client.sendall(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key}\r\n\r\n".encode()
+        )
+        with self.lock:
+            self.connections += 1
+            self.clients.append(client)
+        try:
+            # The client only ever sends a close frame: answer it and hang up
+            if client.recv(4096):
+                client.sendall(b"\x88\x00")
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+
+    @staticmethod
+    def send_message(client, payload):
+        data = json.dumps(payload).encode()
+        # Unmasked text frame, as servers send them
+        header = bytes([0x81, len(data)]) if len(data) < 126 else bytes([0x81, 126]) + len(data).to_bytes(2, "big")
+        try:
+            client.sendall(header + data)
+        except OSError:
+            pass
+
+
+def signal_ready(ready_fd):
+    """
+    Entry point of the benchmark process type: tell the parent the process is running, then exit.
+    """
+    os.write(ready_fd, b"x")
@@ -0,0 +1,268 @@
+'''
+Offline benchmark suite: capture, image encoding, UI preview resizing, process spawn/terminate
+and the Groq/Ollama client paths. Runs headless with no network, using synthetic screenshots,
+a fake mss source and local stub API servers.
+
+Usage:
+    python -m benchmarks.suite [--quick] [--output results.json]
+        [--baseline benchmarks/baseline.json] [--threshold 0.2] [--update-baseline]
+
+Results are written as JSON. With a baseline, any benchmark whose p50 is more than `threshold`
+slower (and at least --min-delta-ms) is reported as a regression and the exit code is 1.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+
+# Keep benchmark logs and caches away from the real LOG_DIR, and point the Groq SDK at the stub
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="sa_bench_"))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+from benchmarks.stubs import (
+    RESOLUTIONS,
+    FakeScreenCapture,
+    GroqStubHandler,
+    OllamaStubHandler,
+    start_stub_server,
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(fn, iterations, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "runs": len(timings),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))], 3),
+        "min_ms": round(timings[0], 3),
+    }
+
+
+def bench_capture(results, resolutions, iterations):
+    import utils
+    from capture import SharedFrame
+    original = utils.screen_capture
+    try:
+        for label, (width, height) in resolutions.items():
+            utils.screen_capture = FakeScreenCapture(width, height)
+            region = (width // 4, height // 4, width // 2, height // 2)
+            results[f"capture.full.{label}"] = measure(lambda: utils.grab_screenshot(monitor=1), iterations)
+            results[f"capture.region.{label}"] = measure(lambda: utils.grab_screenshot(region=region), iterations)
+            # Hotkey-time capture in the parent, handed to the UI through shared memory
+            def share_and_read():
+                shared_frame = SharedFrame.share(utils.screen_capture.grab(monitor=1))
+                try:
+                    return shared_frame.to_image()
+                finally:
+                    shared_frame.unlink()
+            results[f"capture.shared.{label}"] = measure(share_and_read, iterations)
+    finally:
+        utils.screen_capture = original
+
+
+def bench_encoding(results, resolutions, iterations):
+    import utils
+    from ModelClients import BACKEND_ENCODING
+    for label, (width, height) in resolutions.items():
+        image = FakeScreenCapture(width, height).grab(monitor=1).to_image()
+        results[f"encode.png_base64.{label}"] = measure(lambda: utils.image_pil_to_base64(image), iterations)
+        results[f"encode.groq_limits.{label}"] = measure(lambda: utils.encode_image(image, **BACKEND_ENCODING["groq"]), iterations)
+
+
+def bench_ui(results, resolutions, iterations):
+    try:
+        from Processes.ui import fast_resize, PreviewPyramid
+    except ImportError as e:
+        print(f"Skipping UI benchmarks: {e}")
+        return
+    for label, (width, height) in resolutions.items():
+        image = FakeScreenCapture(width, height).grab(monitor=1).to_image()
+        # The canvas preview is shown at roughly the screen size divided by the backing scale factor
+        display_size = (width // 2, height // 2)
+        results[f"ui.fast_resize.{label}"] = measure(lambda: fast_resize(image, display_size), iterations)
+        results[f"ui.preview_pyramid.{label}"] = measure(lambda: PreviewPyramid(image, display_size), iterations)
+        crop_box = (width // 4, height // 4, width // 2, height // 2)
+        results[f"ui.crop_resize.{label}"] = measure(lambda: fast_resize(image.crop(crop_box), (600, 340)), iterations)
+
+
+def bench_processes(results, iterations):
+    from Processes import ProcessManager, ProcessType
+    ready_read, ready_write = os.pipe()
+    process_type = ProcessType("benchmark", None, "benchmarks.stubs", "signal_ready")
+
+    def make_manager(pool_size):
+        pm = ProcessManager()
+        pm.process_type_map = {"benchmark": process_type}
+        pm.pool_sizes = {"benchmark": pool_size}
+        pm.warm_workers = {"benchmark": []}
+        return pm
+
+    def trigger(pm):
+        pm.reset_process("benchmark", process_args=(ready_write,))
+        os.read(ready_read, 1)
+
+    def terminate(pm):
+        proc = pm.running_processes["benchmark"]
+        pm.terminate_process("benchmark")
+        proc.join()
+
+    cold = make_manager(0)
+    results["process.spawn_cold"] = measure(lambda: (trigger(cold), terminate(cold)), iterations)
+
+    warm = make_manager(1)
+    warm.start_pools()
+    timings = []
+    for _ in range(iterations):
+        # Wait for the replacement worker so every trigger finds a warm one
+        while not any(proc.is_alive() for proc, _ in warm.warm_workers["benchmark"]):
+            time.sleep(0.005)
+        time.sleep(0.05)
+        start = time.perf_counter()
+        trigger(warm)
+        timings.append((time.perf_counter() - start) * 1000)
+        terminate(warm)
+    results["process.trigger_warm"] = summarize(timings)
+    warm.terminate_all()
+    os.close(ready_read)
+    os.close(ready_write)
+
+
+def bench_model_clients(results, iterations, latency):
+    groq_server, groq_url = start_stub_server(GroqStubHandler, latency=latency)
+    ollama_server, ollama_url = start_stub_server(OllamaStubHandler, latency=latency)
+    os.environ["GROQ_BASE_URL"] = groq_url
+    import ModelClients.groq as groq_client
+    import ModelClients.ollama as ollama_client
+    groq_client.client = None
+    ollama_client.client = None
+    ollama_client.OLLAMA_SERVER_HOSTNAME, ollama_client.OLLAMA_SERVER_PORT = "127.0.0.1", str(ollama_server.server_address[1])
+
+    import utils
+    image = FakeScreenCapture(*RESOLUTIONS["1080p"]).grab(region=(0, 0, 800, 600)).to_image()
+    context = {
+        "encoded_image": utils.image_pil_to_base64(image),
+        "mime_type": "image/png",
+        "prompt": "Detect text",
+        "model_name": "stub-model",
+        "timeout": 30,
+        "cancel_event": None,
+    }
+    try:
+        # Subtract the stub's fixed latency so the numbers show client-side overhead
+        for name, call in [
+            ("groq.send", lambda: groq_client.send_to_groq(context)),
+            ("groq.stream", lambda: "".join(groq_client.stream_groq(context))),
+            ("ollama.send", lambda: ollama_client.send_to_ollama(context)),
+            ("ollama.stream", lambda: "".join(ollama_client.stream_ollama(context))),
+        ]:
+            stats = measure(call, iterations)
+            for key in ("p50_ms", "p95_ms", "min_ms"):
+                stats[key] = round(stats[key] - latency * 1000, 3)
+            results[f"model.{name}_overhead"] = stats
+    finally:
+        groq_server.shutdown()
+        ollama_server.shutdown()
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """
+    Returns (name, baseline p50, current p50) for every benchmark that regressed.
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        delta = stats["p50_ms"] - base["p50_ms"]
+        if delta > min_delta_ms and stats["p50_ms"] > base["p50_ms"] * (1 + threshold):
+            regressions.append((name, base["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SelfAutomate benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="1080p and 4K only, fewer iterations")
+    parser.add_argument("--iterations", type=int, default=None)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub API latency in seconds")
+    parser.add_argument("--only", nargs="*", default=None, choices=["capture", "encode", "ui", "process", "model"])
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p50 slowdown as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    resolutions = {label: RESOLUTIONS[label] for label in ("1080p", "4k")} if args.quick else RESOLUTIONS
+    iterations = args.iterations or (5 if args.quick else 15)
+    selected = set(args.only or ["capture", "encode", "ui", "process", "model"])
+
+    results = {}
+    start = time.perf_counter()
+    if "capture" in selected:
+        bench_capture(results, resolutions, iterations)
+    if "encode" in selected:
+        bench_encoding(results, resolutions, max(3, iterations // 3))
+    if "ui" in selected:
+        bench_ui(results, resolutions, iterations)
+    if "process" in selected:
+        bench_processes(results, iterations)
+    if "model" in selected:
+        bench_model_clients(results, iterations, args.latency)
+
+    for name, stats in results.items():
+        print(f"{name:<36} p50 {stats['p50_ms']:9.2f} ms   p95 {stats['p95_ms']:9.2f} ms")
+    print(f"Suite finished in {time.perf_counter() - start:.1f} s")
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "stub_latency_s": args.latency,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to store one")
+        return 0
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)["results"]
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: p50 {before:.2f} ms -> {after:.2f} ms (+{(after / before - 1) * 100:.0f}%)")
+    if not regressions:
+        print(f"No regressions beyond {args.threshold * 100:.0f}% against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import threading
+
+import logger
+from lazyload import lazy_import
+
+
+class Frame:
+    '''
+    A captured BGRA frame. `buffer` is a zero-copy memoryview over the capture backend's
+    pixel buffer; convert only the part you need with `to_image`.
+    '''
+    def __init__(self, raw, left: int, top: int, width: int, height: int):
+        self.buffer = memoryview(raw)
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        # Bytes per row (some backends pad rows)
+        self.stride = len(self.buffer) // height if height else width * 4
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def to_image(self, box=None):
+        """
+        Convert the frame, or only `box` (left, top, right, bottom in frame coordinates), to an RGB PIL image.
+        Only the rows covered by `box` are decoded.
+        """
+        Image = lazy_import("PIL.Image")
+        left, top, right, bottom = box if box is not None else (0, 0, self.width, self.height)
+        left, right = max(0, int(left)), min(self.width, int(right))
+        top, bottom = max(0, int(top)), min(self.height, int(bottom))
+        rows = self.buffer[top * self.stride:bottom * self.stride]
+        image = Image.frombuffer("RGB", (self.width, bottom - top), rows, "raw", "BGRX", self.stride, 1)
+        if left != 0 or right != self.width:
+            image = image.crop((left, 0, right, bottom - top))
+        return image
+
+
+class ScreenCapture:
+    '''
+    Capture engine that keeps its mss handle alive between grabs.
+    mss handles are not shareable across threads or forked processes, so one is kept per thread
+    and recreated after a fork.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+
+    def _sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None or self._local.pid != os.getpid():
+            sct = lazy_import("mss").mss()
+            self._local.sct = sct
+            self._local.pid = os.getpid()
+        return sct
+
+    @property
+    def monitors(self):
+        return self._sct().monitors
+
+    def monitor_at(self, x: int, y: int) -> dict:
+        for monitor in self.monitors[1:]:
+            if monitor["left"] <= x < monitor["left"] + monitor["width"] and monitor["top"] <= y < monitor["top"] + monitor["height"]:
+                return monitor
+        return self.monitors[1]
+
+    def cursor_monitor(self) -> dict:
+        try:
+            x, y = lazy_import("pynput.mouse").Controller().position
+        except Exception as e:
+            logger.log(f"Could not read cursor position, using primary monitor: {e}")
+            return self.monitors[1]
+        return self.monitor_at(int(x), int(y))
+
+    def grab(self, region=None, monitor=None) -> Frame:
+        """
+        Grab a frame.
+        `region` is (left, top, width, height) in screen coordinates; otherwise the whole `monitor`
+        (an mss monitor index or dict) is grabbed, defaulting to the monitor under the cursor.
+        """
+        if region is not None:
+            left, top, width, height = region
+            area = {"left": int(left), "top": int(top), "width": int(width), "height": int(height)}
+        elif monitor is None:
+            area = self.cursor_monitor()
+        elif isinstance(monitor, int):
+            area = self.monitors[monitor]
+        else:
+            area = monitor
+        shot = self._sct().grab(area)
+        return Frame(shot.raw, shot.left, shot.top, shot.width, shot.height)
+
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None and self._local.pid == os.getpid():
+            sct.close()
+        self._local.sct = None
+
+
+# SharedFrame.unlink may run from a process-exit watcher thread and the dispatch thread at once
+unlink_lock = threading.Lock()
+
+
+class SharedFrame:
+    '''
+    A frame copied into a `multiprocessing.shared_memory` block, so a capture taken in the parent can
+    be handed to a worker by name: only this small descriptor is pickled, never the pixels.
+    The parent owns the block: it keeps the creating handle and unlinks it once the worker has exited
+    or been terminated. Workers only attach, copy the pixels out and close their handle.
+    '''
+    def __init__(self, name, nbytes, left, top, width, height, captured_at=None):
+        self.name = name
+        self.nbytes = nbytes
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.captured_at = captured_at
+        # The owner's handle, None in workers and once unlinked
+        self.shm = None
+
+    @classmethod
+    def share(cls, frame: Frame) -> "SharedFrame":
+        shared_memory = lazy_import("multiprocessing.shared_memory")
+        nbytes = len(frame.buffer)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        shm.buf[:nbytes] = frame.buffer
+        shared = cls(shm.name, nbytes, frame.left, frame.top, frame.width, frame.height, time.time())
+        shared.shm = shm
+        return shared
+
+    def __repr__(self):
+        return f"SharedFrame({self.name}, {self.width}x{self.height})"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = None
+        return state
+
+    def attach(self):
+        shared_memory = lazy_import("multiprocessing.shared_memory")
+        if sys.version_info >= (3, 13):
+            # Only the owner tracks the block
+            return shared_memory.SharedMemory(name=self.name, track=False)
+        # Workers share the parent's resource tracker, where the block is already registered
+        return shared_memory.SharedMemory(name=self.name)
+
+    def to_image(self, box=None):
+        """
+        Copy the frame (or `box` of it) out of shared memory as an RGB PIL image.
+        """
+        shm = self.attach()
+        buffer = shm.buf[:self.nbytes]
+        try:
+            return Frame(buffer, self.left, self.top, self.width, self.height).to_image(box)
+        finally:
+            buffer.release()
+            shm.close()
+
+    def unlink(self):
+        """
+        Free the block. Only the owner can; safe to call more than once.
+        """
+        with unlink_lock:
+            shm, self.shm = self.shm, None
+        if shm is None:
+            return
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+screen_capture = ScreenCapture()
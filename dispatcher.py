@@ -0,0 +1,83 @@
+import time
+import threading
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+import logger
+
+END_SIGNAL = "end_signal"
+
+
+class SignalDispatcher:
+    '''
+    Event-driven replacement for a polling signal loop.
+    Signals are put on a blocking queue by listeners (hotkeys, timers) and dispatched to
+    their handlers on a single worker thread, so slow handlers never delay signal intake.
+    Periodic jobs run on their own threads with a fixed schedule.
+    '''
+    def __init__(self):
+        self.queue = Queue()
+        self.handlers = {}
+        self.stop_event = threading.Event()
+        self.timer_threads = []
+        # One worker keeps handler calls (e.g. ProcessManager) serialized
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispatch")
+
+    def on(self, signal_key, handler):
+        """
+        Register `handler(signal_key, trigger_time)` for a signal.
+        """
+        self.handlers[signal_key] = handler
+
+    def signal_listener(self, signal_key):
+        def put_signal():
+            self.queue.put((signal_key, time.time()))
+        return put_signal
+
+    def stop(self):
+        self.signal_listener(END_SIGNAL)()
+
+    def every(self, interval, job, name=None):
+        """
+        Run `job()` every `interval` seconds on a fixed schedule until the dispatcher stops.
+        Missed runs (a job slower than its interval) are skipped instead of bursting.
+        """
+        def run_job():
+            next_run = time.monotonic() + interval
+            while not self.stop_event.wait(max(0.0, next_run - time.monotonic())):
+                try:
+                    job()
+                except Exception as e:
+                    logger.log_error(e, f"Error in scheduled job: {name or job}")
+                next_run += interval
+                now = time.monotonic()
+                if next_run < now:
+                    next_run = now + interval
+        thread = threading.Thread(target=run_job, name=name, daemon=True)
+        thread.start()
+        self.timer_threads.append(thread)
+
+    def dispatch(self, handler, signal_key, trigger_time):
+        logger.log(f"Dispatching {signal_key} after {(time.time() - trigger_time) * 1000:.1f} ms")
+        try:
+            handler(signal_key, trigger_time)
+        except Exception as e:
+            logger.log_error(e, f"Error handling signal: {signal_key}")
+
+    def run(self):
+        """
+        Block on the signal queue until the end signal is received.
+        """
+        while True:
+            signal_key, trigger_time = self.queue.get()
+            logger.log(f"Received process signal: {signal_key}")
+            if signal_key == END_SIGNAL:
+                break
+            handler = self.handlers.get(signal_key)
+            if handler is None:
+                continue
+            self.executor.submit(self.dispatch, handler, signal_key, trigger_time)
+
+    def shutdown(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,93 @@
+import importlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import logger
+
+# Wall time (ms) spent on each module imported through `lazy_import` in this process
+IMPORT_TIMES: dict[str, float] = {}
+# Without it a second thread could get a partially initialized module from sys.modules
+_import_lock = threading.RLock()
+
+REPORT_MODULES = [
+    "Processes",
+    "Processes.ui",
+    "Processes.pushbullet",
+    "Processes.clipboardType",
+    "ModelClients",
+    "ModelClients.groq",
+    "ModelClients.ollama",
+    "groq",
+    "ollama",
+    "utils",
+]
+
+
+def lazy_import(module_name):
+    """
+    Import a module on first use and record how long the import took.
+    """
+    with _import_lock:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            return module
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        elapsed = (time.perf_counter() - start) * 1000
+    IMPORT_TIMES[module_name] = elapsed
+    logger.log(f"Lazy imported {module_name} in {elapsed:.1f} ms")
+    return module
+
+
+def load_attribute(module_name, attribute_name):
+    return getattr(lazy_import(module_name), attribute_name)
+
+
+def measure_import_time(module_name) -> list[tuple[int, int, str]]:
+    """
+    Import `module_name` in a fresh interpreter with `-X importtime`.
+    Returns (cumulative_us, self_us, module) for the module and everything it pulled in, costliest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        logger.log(f"Import of {module_name} failed during import-time report")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            entries.append((len(match.group(3)), int(match.group(2)), int(match.group(1)), match.group(4)))
+    # Children are printed before their parent with a deeper indent, so walk back from the module itself
+    own_index = max((i for i, entry in enumerate(entries) if entry[3] == module_name), default=None)
+    if own_index is None:
+        return []
+    own_indent = entries[own_index][0]
+    tree = [entries[own_index]]
+    for entry in reversed(entries[:own_index]):
+        if entry[0] <= own_indent:
+            break
+        tree.append(entry)
+    return sorted(((cumulative, self_us, name) for _, cumulative, self_us, name in tree), reverse=True)
+
+
+def report_import_times(module_names=REPORT_MODULES, top=5):
+    for module_name in module_names:
+        entries = measure_import_time(module_name)
+        own = next((entry for entry in entries if entry[2] == module_name), None)
+        total_ms = own[0] / 1000 if own else float("nan")
+        print(f"{module_name}: {total_ms:.1f} ms cumulative")
+        for cumulative_us, self_us, name in [entry for entry in entries if entry is not own][:top]:
+            print(f"    {name}: {cumulative_us / 1000:.1f} ms cumulative, {self_us / 1000:.1f} ms self")
+
+
+if __name__ == "__main__":
+    # Usage: python lazyload.py [module ...]
+    report_import_times(sys.argv[1:] or REPORT_MODULES)
@@ -1,7 +1,19 @@
 from datetime import datetime
+import atexit
 import os
 import json
-from traceback import print_exception
+import threading
+import time
+from queue import SimpleQueue, Empty
+from traceback import format_exception
+from multiprocessing import current_process
+from multiprocessing.util import Finalize
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writes are still batched, just without the cross-process file lock
+    fcntl = None
 
 # Variables for logging
 PID = str(os.getpid())
@@ -16,9 +28,23 @@ if LOG_DIR is None:
 RUNNING_FILE = "running_lock.json"
 EXECUTABILITY_FILE = "text_detect_test.log"
 PROCESS_LOG_FILE = "process.log"
+METRICS_FILE = "metrics.jsonl"
+
+# Log backend configuration
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (JSON lines)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 2**20))
+LOG_MAX_AGE = int(os.getenv("LOG_MAX_AGE", 7 * 24 * 60 * 60))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+
+_time_cache = (None, None)
 
 def getCurrentTime():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # strftime once per second rather than once per call
+    global _time_cache
+    second = int(time.time())
+    if _time_cache[0] != second:
+        _time_cache = (second, datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S"))
+    return _time_cache[1]
 
 
 def check_pid_exists(pid_num: int) -> bool:
@@ -97,34 +123,186 @@ def test_executability():
         current_dir = os.getcwd()
         file.write(f"Current directory: {current_dir}\n")
         
+class LogWriter:
+    '''
+    Background writer for the process log. Callers only format and enqueue a line; a daemon thread
+    drains the queue and appends each batch with a single write under an exclusive file lock,
+    so several processes can share the log. The log is rotated by size and age.
+    '''
+    def __init__(self, file_name, max_bytes=LOG_MAX_BYTES, max_age=LOG_MAX_AGE, backups=LOG_BACKUPS):
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.start_lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.age_checked_at = 0
+
+    @property
+    def path(self):
+        return os.path.join(LOG_DIR, self.file_name)
+
+    def ensure_started(self):
+        # A forked child inherits neither the writer thread nor a usable queue, so start fresh per PID
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = SimpleQueue()
+            self.age_checked_at = 0
+            threading.Thread(target=self.run, name="log-writer", daemon=True).start()
+            self.pid = os.getpid()
+            # multiprocessing children exit through os._exit, skipping atexit, and clear inherited
+            # finalizers on start - so register one from inside each process that logs
+            Finalize(self, self.flush, exitpriority=-100)
+
+    def submit(self, line: str):
+        self.ensure_started()
+        self.queue.put(line)
+
+    def flush(self, timeout=2.0):
+        """
+        Block until everything enqueued so far is on disk.
+        """
+        if self.pid != os.getpid():
+            return
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait(timeout)
+
+    def run(self):
+        queue = self.queue
+        while True:
+            batch = [queue.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            lines = [item for item in batch if isinstance(item, str)]
+            try:
+                if lines:
+                    self.write("".join(lines))
+            except Exception as e:
+                print(f"Failed to write log: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def write(self, text: str):
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.rotate_if_needed()
+                with open(self.path, "a") as file:
+                    file.write(text)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def log_started_at(self):
+        """
+        Time of the oldest record in the current log (its first line), or None.
+        """
+        try:
+            with open(self.path, "r") as file:
+                first_line = file.readline()
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        try:
+            if first_line.startswith("{"):
+                timestamp = json.loads(first_line)["time"]
+            else:
+                timestamp = first_line.split("][", 1)[1][:19]
+            return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+        except (IndexError, KeyError, ValueError):
+            return None
+
+    def rotate_if_needed(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        rotate = size >= self.max_bytes
+        # The age check reads the first line, so only do it once a minute
+        now = time.time()
+        if not rotate and self.max_age is not None and now - self.age_checked_at > 60:
+            self.age_checked_at = now
+            started_at = self.log_started_at()
+            rotate = started_at is not None and now - started_at > self.max_age
+        if not rotate:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+log_writer = LogWriter(PROCESS_LOG_FILE)
+atexit.register(log_writer.flush)
+# Metrics are recorded on hot paths (cache lookups, limiter calls), so they go through a writer too
+metrics_writer = LogWriter(METRICS_FILE)
+atexit.register(metrics_writer.flush)
+
+def format_record(level, message):
+    if LOG_FORMAT == "json":
+        return json.dumps({
+            "time": getCurrentTime(),
+            "level": level,
+            "pid": os.getpid(),
+            "process": current_process().name,
+            "message": message,
+        }) + "\n"
+    prefix = f"[{os.getpid()}][{getCurrentTime()}]:"
+    if level != "INFO":
+        prefix += f" [{level}] -"
+    return f"{prefix} {message}\n"
+
 def log(*args):
-    file_path = os.path.join(LOG_DIR, PROCESS_LOG_FILE)
-    current_time = getCurrentTime()
-    with open(file_path, "a") as file:
-        print(f"[{PID}][{current_time}]:", *args, file=file)
+    log_writer.submit(format_record("INFO", " ".join(str(arg) for arg in args)))
 
 def log_debug(*args):
-    file_path = os.path.join(LOG_DIR, PROCESS_LOG_FILE)
-    current_time = getCurrentTime()
-    with open(file_path, "a") as file:
-        print(f"[{PID}][{current_time}]: [DEBUG] -", *args, file=file)
+    log_writer.submit(format_record("DEBUG", " ".join(str(arg) for arg in args)))
 
 def log_error(exception: Exception, *args):
-    file_path = os.path.join(LOG_DIR, PROCESS_LOG_FILE)
-    current_time = getCurrentTime()
-    with open(file_path, "a") as file:
-        print(f"[{PID}][{current_time}]: [ERROR] -", *args, file=file)
-        print_exception(exception, file=file)
+    message = " ".join(str(arg) for arg in args)
+    trace = "".join(format_exception(exception)).rstrip("\n")
+    log_writer.submit(format_record("ERROR", f"{message}\n{trace}" if message else trace))
+    # Errors often precede a crash, so make sure they reach the file
+    log_writer.flush()
+
+def record_metric(metric: str, **fields):
+    """
+    Append a structured measurement (one JSON object per line) to the metrics file.
+    """
+    record = {"time": getCurrentTime(), "pid": str(os.getpid()), "metric": metric, **fields}
+    metrics_writer.submit(json.dumps(record) + "\n")
 
 def access_runtime_config(config_file_path, config: dict = None) -> dict:
+    """
+    Read (config=None) or write a small JSON state file in LOG_DIR. A missing or unreadable file
+    reads as {}. Writes go through a temporary file and a rename, so a process killed mid-write
+    never leaves a torn file behind.
+    """
     file_path = os.path.join(LOG_DIR, config_file_path)
     if config is None:
         try:
             with open(file_path, "r") as file:
                 config = json.load(file)
-        except FileNotFoundError:
+        except (FileNotFoundError, ValueError):
+            config = {}
+        if not isinstance(config, dict):
             config = {}
     else:
-        with open(file_path, "w") as file:
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
             json.dump(config, file)
+        os.replace(tmp_path, file_path)
     return config
@@ -1,9 +1,75 @@
 
-from utils import image_pil_to_base64
+import threading
+import time
+from concurrent.futures import as_completed
+
+from utils import encode_image, submit_background
 import pyperclip
 
-from ModelClients.groq import send_to_groq
-from ModelClients.ollama import send_to_ollama
+import logger
+import tracing
+from lazyload import lazy_import, load_attribute
+from ModelClients.cache import get_response_cache, perceptual_hash, ResponseCache
+from ModelClients.router import get_router, target_name
+from ModelClients.tiling import grid_scale, tile_boxes, merge_tile_texts
+from ModelClients.limiter import limited_call, limited_stream, estimate_tokens, burst_call_budget
+
+
+# Model backends are imported (and their clients built) only when a command first uses them
+# Each backend maps to (module, blocking call, streaming call)
+BACKENDS = {
+    "groq": ("ModelClients.groq", "send_to_groq", "stream_groq"),
+    "ollama": ("ModelClients.ollama", "send_to_ollama", "stream_ollama"),
+}
+
+# Encoding limits per backend: the model's useful maximum resolution and the upload budget (base64 bytes).
+# Llama 3.2 vision tiles images into at most 4 tiles of 560px, and Groq caps base64 images at 4MB.
+BACKEND_ENCODING = {
+    "groq": {"max_side": 1120, "byte_budget": 3_500_000},
+    "ollama": {"max_side": 1120, "byte_budget": None},
+}
+
+def encoding_fits(encoding: dict, backend: str) -> bool:
+    """
+    Whether images encoded with `encoding` stay within `backend`'s limits (so one encoding can serve both).
+    """
+    limits = BACKEND_ENCODING.get(backend, {})
+    for key in ("max_side", "byte_budget"):
+        if limits.get(key) is not None and (encoding.get(key) is None or encoding[key] > limits[key]):
+            return False
+    return True
+
+def get_model_call(backend: str, stream: bool = False):
+    """
+    The backend's call, wrapped with its shared rate limiter, retries and a deadline (see `ModelClients.limiter`).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend}")
+    module_name, call_name, stream_name = BACKENDS[backend]
+    if stream:
+        return limited_stream(backend, load_attribute(module_name, stream_name))
+    return limited_call(backend, load_attribute(module_name, call_name))
+
+def preload_backends(backends=None):
+    for backend in backends or BACKENDS:
+        module_name = BACKENDS[backend][0]
+        load_attribute(module_name, "get_client")()
+
+def preload_local_models():
+    """
+    Load the Ollama models used by COMMANDS_MAP (including fallbacks) so the first command doesn't pay
+    for a cold model load. Failures (e.g. Ollama not running) are only logged.
+    """
+    models = []
+    for config in COMMANDS_MAP.values():
+        targets = [{"backend": config["backend"], "model_name": config["model_name"]}] + config.get("fallbacks", [])
+        models.extend(target["model_name"] for target in targets if target["backend"] == "ollama")
+    preload_model = load_attribute(BACKENDS["ollama"][0], "preload_model")
+    for model_name in dict.fromkeys(models):
+        try:
+            preload_model(model_name)
+        except Exception as e:
+            logger.log(f"Could not preload Ollama model {model_name}: {e}")
 
 
 COMMANDS_MAP = {
@@ -15,66 +81,306 @@ COMMANDS_MAP = {
 3. If any words or phrases are unclear, indicate this with [unclear] in your transcription.
 Provide only the transcription without any additional comments or references.""",
         "model_name": "llama-3.2-11b-vision-preview",
-        "model_call": send_to_groq,
+        "backend": "groq",
+        # Keep text crisp: try lossless PNG and WebP before falling back to JPEG
+        "encoding": {"formats": ("PNG", "WEBP", "JPEG")},
+        # Fall back to the local model on errors, and race it when Groq is slow
+        "fallbacks": [{"backend": "ollama", "model_name": "llama3.2-vision"}],
+        "hedge_after": 5.0,
+        # Large captures are read as a grid of tiles close to the model's native resolution instead of one
+        # heavily downsampled image. The tile count is also capped by what Groq's buckets admit at once.
+        "tiling": {"tile_size": 1120, "overlap": 96, "max_workers": 4, "max_tiles": 4},
     },
     "HELP_ME_SOLVE": {
         "display_string": "Help me solve",
         "prompt": "Identify text in the given image first. Using the trancription text help me solve the problem in the image. Provide a step-by-step solution. Provide the code in Python for the solution.",
         "model_name": "llama-3.2-11b-vision-preview",
-        "model_call": send_to_groq,
+        "backend": "groq",
+        # Asking again usually means a fresh attempt is wanted
+        "cache": False,
     },
     "TRANSLATE_TO_ENGLISH": {
         "display_string": "Translate to English",
         "prompt": "As an Visual Translator, translate the text in the image to English.",
         "model_name": "llama-3.2-11b-vision-preview",
-        "model_call": send_to_groq,
+        "backend": "groq",
     },
     "DESCRIBE_IMAGE": {
         "display_string": "Describe Image",
         "prompt": "Identify and transcribe any text/code/handwritten in the given image. Now refer to the text (if present) and image to describe the contents of the image in detail.",
         "model_name": "llama-3.2-11b-vision-preview",
-        "model_call": send_to_groq,
+        "backend": "groq",
+        # Photos compress far better as JPEG
+        "encoding": {"formats": ("JPEG", "PNG"), "byte_budget": 1_000_000},
     },
     "DETECT_TEXT_LOCAL": {
         "display_string": "Detect Text Locally",
         "prompt": "Here is a screenshot of a desktop screen. Help me detect text in the image. Note if there are complex document structures and might require reordering text, identifying headings, multi-column formats, tables, and mixed content types to maintain the logical flow of information. Arrange the text so it reads correctly from top to bottom. Identify headings, subheadings, sections, bullet points, numbering in lists, or proper indentation ensuring the document's logical and visual structure is preserved. Like recognizing a bold, large font as a heading and appropriately organizing subsequent text as a section. Provide only the transcription without any additional comments or references.",
         "model_name": "llama3.2-vision",
         # "model_name": "hf.co/benxh/Qwen2.5-VL-7B-Instruct-GGUF",
-        "model_call": send_to_ollama,
+        "backend": "ollama",
+        # A local model has no parallel capacity to spare
+        "tiling": {"tile_size": 1120, "overlap": 96, "max_workers": 1, "max_tiles": 4},
     },
 }
 
 
 class Command:
-    def __init__(self, display_string, prompt, model_name, model_call):
+    def __init__(self, display_string, prompt, model_name, backend, encoding=None, cache=True, fallbacks=None, hedge_after=None, tiling=None):
         self.display_string = display_string
         self.prompt = prompt
         self.model_name = model_name
-        self.model_call = model_call
+        self.backend = backend
+        # Per-command overrides of the backend's encoding limits (see `utils.encode_image`)
+        self.encoding = {**BACKEND_ENCODING.get(backend, {}), **(encoding or {})}
+        # False opts out of the response cache; {"perceptual": True} keys it by a perceptual image hash,
+        # which suits commands whose answer survives small pixel changes, never OCR (keys ignore glyph differences)
+        self.cache = {} if cache is True else cache
+        # Backend targets in preference order; with more than one, calls go through the latency-aware router.
+        # Every target is sent the primary's encoding, so fallbacks whose limits it exceeds are left out.
+        self.targets = [{"backend": backend, "model_name": model_name}]
+        for target in fallbacks or []:
+            if encoding_fits(self.encoding, target["backend"]):
+                self.targets.append(target)
+            else:
+                logger.log(f"Skipping fallback {target_name(target)} for {display_string}: its encoding limits are tighter than {backend}'s")
+        self.hedge_after = hedge_after
+        # {"tile_size", "overlap", "max_workers", "max_tiles", "min_scale"}: crops with a side longer than
+        # min_scale * tile_size are split into a grid of at most max_tiles tiles
+        self.tiling = tiling
     
+    @property
+    def model_call(self):
+        return get_model_call(self.backend)
+
+    def routed_stream(self, context):
+        """
+        Stream from the primary target, or through the router; context["routed_target"] reports the target that answered.
+        """
+        if len(self.targets) == 1:
+            context["routed_target"] = self.targets[0]
+            return get_model_call(self.backend, stream=True)(context)
+        return get_router().stream(
+            self.targets,
+            context,
+            lambda backend: get_model_call(backend, stream=True),
+            hedge_after=self.hedge_after,
+            cancel_event=context.get("cancel_event"),
+        )
+
     def __str__(self):
         return self.display_string
 
-    def execute(self, 
-            encoded_image: str = None,
-            prompt: str = None,
-        ) -> str:
-        context = {
+    def build_context(self, encoded_image=None, prompt=None, mime_type="image/png", timeout=None, cancel_event=None) -> dict:
+        return {
             "encoded_image": encoded_image,
+            "mime_type": mime_type,
             "prompt": self.prompt if prompt is None else prompt,
             "model_name": self.model_name,
+            "timeout": timeout,
+            "cancel_event": cancel_event,
         }
-        
-        return self.model_call(context)
+
+    def cache_key(self, encoded_image: str = None, prompt: str = None, image_key: str = None, target: dict = None):
+        """
+        Response cache key for an answer from `target` (the primary by default), or None when this command
+        opts out of caching. Lookups use the primary, so a fallback's answer is never served as the primary's.
+        """
+        if self.cache is False:
+            return None
+        if image_key is None:
+            image_key = ResponseCache.image_key(encoded_image)
+        return ResponseCache.make_key(image_key, self.prompt if prompt is None else prompt, target_name(target or self.targets[0]))
+
+    def image_cache_key(self, image):
+        if self.cache is False or not self.cache.get("perceptual"):
+            return None
+        return perceptual_hash(image)
+
+    def execute(self, 
+            encoded_image: str = None,
+            prompt: str = None,
+            mime_type: str = "image/png",
+            timeout: float = None,
+            image_key: str = None,
+            lookup_cache: bool = True,
+        ) -> str:
+        with tracing.span("command.execute", command=self.display_string, backend=self.backend) as span:
+            cache_key = self.cache_key(encoded_image, prompt, image_key)
+            if cache_key is not None and lookup_cache:
+                cached = get_response_cache().get(cache_key)
+                if cached is not None:
+                    span.set(cached=True)
+                    return cached
+            context = self.build_context(encoded_image, prompt, mime_type, timeout)
+            start_time = time.perf_counter()
+            if len(self.targets) == 1:
+                response = self.model_call(context)
+                target = self.targets[0]
+            else:
+                response = "".join(self.routed_stream(context))
+                target = context.get("routed_target", self.targets[0])
+                span.set(routed=target_name(target))
+        logger.record_metric(
+            "model_call",
+            command=self.display_string,
+            backend=target["backend"],
+            model=target["model_name"],
+            total_ms=round((time.perf_counter() - start_time) * 1000, 1),
+        )
+        if cache_key is not None:
+            get_response_cache().put(self.cache_key(encoded_image, prompt, image_key, target), response)
+        return response
+
+    @tracing.traced("command.stream")
+    def stream(self,
+            encoded_image: str = None,
+            prompt: str = None,
+            mime_type: str = "image/png",
+            timeout: float = None,
+            cancel_event=None,
+            image_key: str = None,
+            lookup_cache: bool = True,
+        ):
+        """
+        Like `execute`, but yields the response text as it arrives (a cached response is yielded whole).
+        Time to first token, tokens/sec (one streamed chunk is roughly one token) and total latency
+        are recorded once the stream ends.
+        """
+        cache_key = self.cache_key(encoded_image, prompt, image_key)
+        if cache_key is not None and lookup_cache:
+            cached = get_response_cache().get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        context = self.build_context(encoded_image, prompt, mime_type, timeout, cancel_event)
+        start_time = time.perf_counter()
+        first_token_time = None
+        chunks = 0
+        completed = False
+        parts = []
+        try:
+            for text in self.routed_stream(context):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                chunks += 1
+                parts.append(text)
+                yield text
+            completed = cancel_event is None or not cancel_event.is_set()
+            if completed and cache_key is not None:
+                get_response_cache().put(self.cache_key(encoded_image, prompt, image_key, context.get("routed_target")), "".join(parts))
+        finally:
+            end_time = time.perf_counter()
+            generation_time = end_time - first_token_time if first_token_time is not None else 0
+            target = context.get("routed_target", self.targets[0])
+            metrics = {
+                "command": self.display_string,
+                "backend": target["backend"],
+                "model": target["model_name"],
+                "completed": completed,
+                "ttft_ms": round((first_token_time - start_time) * 1000, 1) if first_token_time is not None else None,
+                "tokens": chunks,
+                "tokens_per_sec": round(chunks / generation_time, 1) if generation_time > 0 else None,
+                "total_ms": round((end_time - start_time) * 1000, 1),
+            }
+            logger.record_metric("model_stream", **metrics)
+            logger.log(f"Stream for {self}: {metrics}")
     
-    def invoke_with_image(self, image):
+    def encode_image(self, image):
+        encoded = encode_image(image, **self.encoding)
+        logger.log(f"Encoded image for {self}: {encoded}")
+        return encoded
+
+    def needs_tiling(self, image) -> bool:
+        if not self.tiling:
+            return False
+        return max(image.size) > self.tiling["tile_size"] * self.tiling.get("min_scale", 1.5) and self.max_tiles() > 1
+
+    def max_tiles(self) -> int:
+        """
+        The tiling's max_tiles, lowered to the number of image calls the backend's rate limits admit at once,
+        so a tiled call never queues for budget mid-way.
+        """
+        max_tiles = self.tiling.get("max_tiles", 4)
+        budget = burst_call_budget(self.backend, estimate_tokens({"prompt": self.prompt, "encoded_image": True}))
+        return max_tiles if budget is None else max(1, min(max_tiles, budget))
+
+    def invoke_tiled(self, image, timeout=None, cancel_event=None) -> str:
+        """
+        Transcribe `image` as a grid of overlapping tiles at the model's native resolution, with at most
+        `max_workers` tiles in flight, and merge the results in reading order.
+        Images that no grid of `max_tiles` tiles covers are downsampled to fit the best one.
+        """
+        tile_size = self.tiling["tile_size"]
+        overlap = self.tiling.get("overlap", 96)
+        scale = grid_scale(image.width, image.height, tile_size, overlap, self.max_tiles())
+        if scale < 1:
+            Image = lazy_import("PIL.Image")
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), resample=Image.Resampling.LANCZOS)
+        rows = tile_boxes(image.width, image.height, tile_size, overlap)
+        boxes = [box for row in rows for box in row]
+        slots = threading.BoundedSemaphore(self.tiling.get("max_workers", 2))
+        start_time = time.perf_counter()
+
+        def run_tile(index, box):
+            with slots:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RuntimeError(f"Cancelled before tile {index}: {self}")
+                tile_start = time.perf_counter()
+                with tracing.span("command.tile", command=self.display_string, tile=index):
+                    encoded = self.encode_image(image.crop(box))
+                    if cancel_event is None:
+                        text = self.execute(encoded_image=encoded.data, mime_type=encoded.mime_type, timeout=timeout)
+                    else:
+                        # Streaming lets a cancel close in-flight requests
+                        text = "".join(self.stream(encoded_image=encoded.data, mime_type=encoded.mime_type, timeout=timeout, cancel_event=cancel_event))
+                tile_ms = (time.perf_counter() - tile_start) * 1000
+                logger.log(f"Tile {index + 1}/{len(boxes)} {box} of {self} took {tile_ms:.0f} ms")
+                logger.record_metric("tile", command=self.display_string, tile=index, tiles=len(boxes), box=list(box), total_ms=round(tile_ms, 1))
+                return text
+
+        futures = [submit_background(run_tile, index, box) for index, box in enumerate(boxes)]
+        texts = iter([future.result() for future in futures])
+        response = merge_tile_texts([[next(texts) for _ in row] for row in rows])
+        logger.log(f"Tiled {self} as {len(boxes)} tiles of {image.size} in {time.perf_counter() - start_time:.1f} s")
+        return response
+
+    def invoke_with_image(self, image, copy_to_clipboard=True, timeout=None, on_token=None, cancel_event=None, encoded=None):
         """
         Invoke the model with an image.
+        With `on_token`, the response is streamed and each piece of text is passed to it as it arrives.
+        `encoded` reuses an existing encoding of the image instead of encoding it again.
+        Crops too large for the model's native resolution are split into tiles for commands with `tiling`;
+        the merged text is then passed to `on_token` once at the end.
         """
-        encoded_image = image_pil_to_base64(image)
-        response = self.execute(encoded_image=encoded_image)
-        # Copy the response to the clipboard
-        pyperclip.copy(response)
+        image_key = self.image_cache_key(image)
+        # With a perceptual key a cache hit skips encoding entirely
+        cached = get_response_cache().get(self.cache_key(image_key=image_key)) if image_key is not None else None
+        if cached is not None:
+            response = cached
+            if on_token is not None:
+                on_token(cached)
+        elif self.needs_tiling(image):
+            response = self.invoke_tiled(image, timeout=timeout, cancel_event=cancel_event)
+            if image_key is not None and (cancel_event is None or not cancel_event.is_set()):
+                get_response_cache().put(self.cache_key(image_key=image_key), response)
+            if on_token is not None:
+                on_token(response)
+        elif on_token is None:
+            encoded = encoded or self.encode_image(image)
+            response = self.execute(encoded_image=encoded.data, mime_type=encoded.mime_type, timeout=timeout, image_key=image_key, lookup_cache=image_key is None)
+        else:
+            encoded = encoded or self.encode_image(image)
+            parts = []
+            for text in self.stream(encoded_image=encoded.data, mime_type=encoded.mime_type, timeout=timeout, cancel_event=cancel_event, image_key=image_key, lookup_cache=image_key is None):
+                parts.append(text)
+                on_token(text)
+            response = "".join(parts)
+        if copy_to_clipboard:
+            # Copy the response to the clipboard
+            with tracing.span("clipboard"):
+                pyperclip.copy(response)
+        return response
 
 
 # COMMANDS = {
@@ -88,3 +394,61 @@ COMMANDS = [
 ] 
 
 
+
+
+def run_commands(commands, image, max_workers=3, timeout=None, on_result=None, cancel_event=None) -> list:
+    """
+    Run several commands on one image concurrently, with at most `max_workers` calls in flight.
+    Commands with the same encoding settings share one encoding of the image.
+    `on_result(command, response, error)` is called from the worker thread as each command finishes.
+    Returns (command, response, error) tuples in the order of `commands`.
+    """
+    encodings = {}
+    encoding_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_workers)
+
+    def shared_encoding(command):
+        key = repr(sorted(command.encoding.items()))
+        with encoding_lock:
+            if key not in encodings:
+                encodings[key] = command.encode_image(image)
+            return encodings[key]
+
+    def run_command(command):
+        with slots:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RuntimeError(f"Cancelled before start: {command}")
+            return command.invoke_with_image(
+                image,
+                copy_to_clipboard=False,
+                timeout=timeout,
+                # Streaming lets a cancel close in-flight requests
+                on_token=(lambda text: None) if cancel_event is not None else None,
+                cancel_event=cancel_event,
+                # Tiled commands encode their own tiles
+                encoded=None if command.needs_tiling(image) else shared_encoding(command),
+            )
+
+    start_time = time.perf_counter()
+    futures = {submit_background(run_command, command): command for command in commands}
+    results = {}
+    for future in as_completed(futures):
+        command = futures[future]
+        error = future.exception()
+        response = None if error is not None else future.result()
+        results[command] = (response, error)
+        logger.log(f"Fan-out command {command} finished after {time.perf_counter() - start_time:.1f} s" + (f" with error: {error}" if error else ""))
+        if on_result is not None:
+            on_result(command, response, error)
+    logger.log(f"Fan-out of {len(commands)} commands took {time.perf_counter() - start_time:.1f} s")
+    return [(command, *results[command]) for command in commands]
+
+
+def combine_responses(results) -> str:
+    """
+    Join (command, response, error) results into one text, in the given order, skipping failures.
+    """
+    responses = [(command, response) for command, response, error in results if error is None and response]
+    if len(responses) == 1:
+        return responses[0][1]
+    return "\n\n".join(f"## {command}\n{response}" for command, response in responses)
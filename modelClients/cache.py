@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logger
+from lazyload import lazy_import
+
+CACHE_DIR_NAME = "response_cache"
+# Image sizes in perceptual keys are rounded to this many pixels, so a re-drawn selection of the same area matches
+SIZE_QUANTUM = 16
+
+
+def perceptual_hash(image_pil, hash_size=16) -> str:
+    """
+    Difference hash: near-identical captures (re-grabs of an unchanged page) hash to the same value.
+    Too coarse to tell glyphs apart ("1234" vs "9876"), so it must not key responses that transcribe text.
+    """
+    Image = lazy_import("PIL.Image")
+    small = image_pil.convert("L").resize((hash_size + 1, hash_size), resample=Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    # The (rounded) size is part of the hash so a crop and its full-screen source never collide
+    size = f"{round(image_pil.width / SIZE_QUANTUM)}x{round(image_pil.height / SIZE_QUANTUM)}"
+    return f"{size}:{bits:0{hash_size * hash_size // 4}x}"
+
+
+class ResponseCache:
+    '''
+    Model responses keyed by (image, prompt, model): an in-memory LRU in front of a
+    size-bounded directory of JSON files that survives process restarts.
+    '''
+    def __init__(self, cache_dir, memory_entries=64, max_disk_bytes=20 * 2**20, ttl=7 * 24 * 60 * 60):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_key: str, prompt: str, model_name: str) -> str:
+        digest = hashlib.sha256()
+        for part in (image_key, prompt, model_name):
+            digest.update((part or "").encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def image_key(encoded_image: str) -> str:
+        return hashlib.sha256((encoded_image or "").encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remember(self, key, created, response):
+        self.memory[key] = (created, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                try:
+                    with open(self._path(key), "r") as file:
+                        record = json.load(file)
+                    entry = (record["created"], record["response"])
+                except (FileNotFoundError, ValueError, KeyError):
+                    entry = None
+            if entry is not None and self._expired(entry[0]):
+                self.memory.pop(key, None)
+                self._remove(self._path(key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                self.log_stats("miss")
+                return None
+            self._remember(key, *entry)
+            self.hits += 1
+            self.log_stats("hit")
+            return entry[1]
+
+    def put(self, key, response):
+        if response is None:
+            return
+        created = time.time()
+        with self.lock:
+            self._remember(key, created, response)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"created": created, "response": response}, file)
+            # Atomic so concurrent processes never read a partial entry
+            os.replace(tmp_path, path)
+            self.evict_disk()
+
+    def evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            if self._expired(stat.st_mtime):
+                self._remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        # Oldest entries go first once over the size bound
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def log_stats(self, outcome):
+        logger.log(f"Response cache {outcome} (hits={self.hits}, misses={self.misses})")
+        logger.record_metric("response_cache", outcome=outcome, hits=self.hits, misses=self.misses)
+
+
+response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache(os.path.join(logger.LOG_DIR, CACHE_DIR_NAME))
+    return response_cache
@@ -1,18 +1,35 @@
 import os
 
-from typing import Dict
-from groq import Groq
+from typing import Dict, Iterator
+
+from lazyload import lazy_import
+import tracing
 
 API_KEY = os.getenv("GROQ_API_KEY")
 
-client = Groq(
-    api_key=API_KEY,
-)
+client = None
 
-def send_to_groq(context: Dict[str, str]) -> str:
+def get_client():
+    global client
+    if client is None:
+        Groq = lazy_import("groq").Groq
+        client = Groq(
+            api_key=API_KEY,
+            # Retries are handled by ModelClients.limiter, which shares backoff across processes
+            max_retries=0,
+        )
+    return client
+
+def request_options(context: Dict[str, str]) -> dict:
+    # Passing timeout=None would disable the SDK's default timeout, so only forward a real value
+    if context.get("timeout") is None:
+        return {}
+    return {"timeout": context["timeout"]}
+
+def build_messages(context: Dict[str, str]) -> list:
     prompt = context["prompt"]
     encoded_image = context["encoded_image"]
-    model_name = context["model_name"]
+    mime_type = context.get("mime_type", "image/png")
     
     chat_content = []
     if prompt:
@@ -32,20 +49,53 @@ def send_to_groq(context: Dict[str, str]) -> str:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}",
+                            "url": f"data:{mime_type};base64,{encoded_image}",
                         },
                     },
                 ],
             }
         )
-    
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": chat_content,
-            }
-        ],
-        model=model_name,
+    return [
+        {
+            "role": "user",
+            "content": chat_content,
+        }
+    ]
+
+def record_usage(context: Dict[str, str], usage) -> None:
+    # Real token usage for the rate limiter (see ModelClients.limiter), when the response reports it
+    if usage is not None and getattr(usage, "total_tokens", None) is not None:
+        context["used_tokens"] = usage.total_tokens
+
+@tracing.traced("groq.send")
+def send_to_groq(context: Dict[str, str]) -> str:
+    chat_completion = get_client().chat.completions.create(
+        messages=build_messages(context),
+        model=context["model_name"],
+        **request_options(context),
+    )
+    record_usage(context, chat_completion.usage)
+    return chat_completion.choices[0].message.content
+
+@tracing.traced("groq.stream")
+def stream_groq(context: Dict[str, str]) -> Iterator[str]:
+    """
+    Yield the completion text as it arrives. Setting `context["cancel_event"]` closes the stream.
+    """
+    cancel_event = context.get("cancel_event")
+    stream = get_client().chat.completions.create(
+        messages=build_messages(context),
+        model=context["model_name"],
+        stream=True,
+        **request_options(context),
     )
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # Groq reports usage on the final chunk
+            record_usage(context, getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None))
+    finally:
+        stream.close()
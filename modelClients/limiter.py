@@ -0,0 +1,310 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import logger
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: limits then only hold within one process
+    fcntl = None
+
+LIMITS_DIR_NAME = "limits"
+
+# Client-side limits per backend (applied per model): request and token rates (per minute, None for
+# unlimited), how many requests may burst at once, and how many calls may be in flight together.
+# Groq's free tier allows 30 requests and 7,000 tokens per minute for the vision models.
+BACKEND_LIMITS = {
+    "groq": {"requests_per_minute": 30, "request_burst": 5, "tokens_per_minute": 7000, "max_in_flight": 4},
+    # A local Ollama serves one generation at a time; queueing here beats queueing inside the server
+    "ollama": {"requests_per_minute": None, "request_burst": 1, "tokens_per_minute": None, "max_in_flight": 1},
+}
+# Token cost assumed for an image when acquiring; the lease is settled against the usage the
+# backend reports in context["used_tokens"] (prompt and completion tokens) once the call ends
+IMAGE_TOKEN_ESTIMATE = 1200
+# Deadline for a call (including queueing and retries) when the caller sets no timeout
+DEFAULT_DEADLINE = 120
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+# In-flight slots of a process that died without releasing them expire after this long
+LEASE_TTL = 600
+RETRYABLE_STATUS = {408, 409, 425, 429}
+
+
+class LimiterTimeout(TimeoutError):
+    pass
+
+
+def estimate_tokens(context) -> int:
+    tokens = len(context.get("prompt") or "") // 4
+    if context.get("encoded_image"):
+        tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+def burst_call_budget(backend: str, tokens_per_call: int):
+    """
+    How many calls of about `tokens_per_call` tokens the backend's buckets admit at once, or None when unlimited.
+    """
+    limits = BACKEND_LIMITS.get(backend, {})
+    budgets = []
+    if limits.get("requests_per_minute"):
+        budgets.append(limits.get("request_burst", 1))
+    if limits.get("tokens_per_minute"):
+        budgets.append(limits["tokens_per_minute"] // max(1, tokens_per_call))
+    return min(budgets) if budgets else None
+
+
+def retry_after(error):
+    """
+    Seconds to wait according to the Retry-After (or retry-after-ms) header of a failed response, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error) -> bool:
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    # SDK connection and timeout errors (groq.APIConnectionError, httpx.ConnectError, ...)
+    return isinstance(error, (ConnectionError, TimeoutError)) or re.search(r"Connect|Timeout", type(error).__name__) is not None
+
+
+def backoff_delay(attempt: int, error=None) -> float:
+    """
+    Full-jitter exponential backoff, stretched to honour the server's Retry-After.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    server_delay = retry_after(error) if error is not None else None
+    return max(delay, server_delay) if server_delay is not None else delay
+
+
+class Limiter:
+    '''
+    Token buckets for requests and tokens plus an in-flight cap for one backend/model.
+    The state lives in a JSON file under LOG_DIR guarded by an exclusive file lock, so the
+    UI, pooled workers and background processes all draw from the same budget.
+    '''
+    def __init__(self, name, requests_per_minute=None, request_burst=1, tokens_per_minute=None, max_in_flight=None):
+        self.name = name
+        self.request_rate = requests_per_minute / 60 if requests_per_minute else None
+        self.request_burst = max(1, request_burst)
+        self.token_rate = tokens_per_minute / 60 if tokens_per_minute else None
+        self.token_capacity = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.thread_lock = threading.Lock()
+        limits_dir = os.path.join(logger.LOG_DIR, LIMITS_DIR_NAME)
+        os.makedirs(limits_dir, exist_ok=True)
+        self.path = os.path.join(limits_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", name) + ".json")
+
+    def update_state(self, update):
+        """
+        Apply `update(state, now)` to the shared state under the lock and return its result.
+        """
+        with self.thread_lock, open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path, "r") as file:
+                        state = json.load(file)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    state = {}
+                now = time.time()
+                self.refill(state, now)
+                result = update(state, now)
+                with open(self.path, "w") as file:
+                    json.dump(state, file)
+                return result
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refill(self, state, now):
+        elapsed = max(0.0, now - state.get("updated", now))
+        state["updated"] = now
+        if self.request_rate is not None:
+            state["requests"] = min(self.request_burst, state.get("requests", self.request_burst) + elapsed * self.request_rate)
+        if self.token_rate is not None:
+            state["tokens"] = min(self.token_capacity, state.get("tokens", self.token_capacity) + elapsed * self.token_rate)
+        # Drop slots held by processes that are gone
+        state["in_flight"] = [
+            lease for lease in state.get("in_flight", [])
+            if now - lease["started"] < LEASE_TTL and logger.check_pid_exists(lease["pid"])
+        ]
+
+    def acquire(self, tokens: int, deadline: float) -> dict:
+        """
+        Wait for a slot and budget for a call of about `tokens` tokens. Returns a lease for `release`.
+        """
+        if self.token_capacity is not None:
+            tokens = min(tokens, self.token_capacity)
+        lease = {"id": f"{os.getpid()}-{threading.get_ident()}-{random.getrandbits(32):08x}", "pid": os.getpid(), "tokens": tokens}
+
+        def try_acquire(state, now):
+            waits = [state.get("blocked_until", 0) - now]
+            if self.max_in_flight is not None and len(state["in_flight"]) >= self.max_in_flight:
+                waits.append(0.1)
+            if self.request_rate is not None and state["requests"] < 1:
+                waits.append((1 - state["requests"]) / self.request_rate)
+            if self.token_rate is not None and state["tokens"] < tokens:
+                waits.append((tokens - state["tokens"]) / self.token_rate)
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            if self.request_rate is not None:
+                state["requests"] -= 1
+            if self.token_rate is not None:
+                state["tokens"] -= tokens
+            state["in_flight"].append({**lease, "started": now})
+            return 0
+
+        while True:
+            wait = self.update_state(try_acquire)
+            if wait <= 0:
+                return lease
+            if time.time() + wait > deadline:
+                raise LimiterTimeout(f"{self.name}: no capacity before the deadline (next slot in {wait:.1f} s)")
+            # Re-check often enough to notice released in-flight slots
+            time.sleep(min(wait, 0.25))
+
+    def release(self, lease, used_tokens=None):
+        def do_release(state, now):
+            state["in_flight"] = [held for held in state["in_flight"] if held["id"] != lease["id"]]
+            if self.token_rate is not None and used_tokens is not None:
+                # Settle the estimate against real usage
+                state["tokens"] = min(self.token_capacity, state["tokens"] + lease["tokens"] - used_tokens)
+        self.update_state(do_release)
+
+    def block(self, seconds: float):
+        """
+        Pause every caller of this limiter (e.g. after a 429 with Retry-After).
+        """
+        def do_block(state, now):
+            state["blocked_until"] = max(state.get("blocked_until", 0), now + seconds)
+        self.update_state(do_block)
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+def get_limiter(backend: str, model_name: str) -> Limiter:
+    name = f"{backend}/{model_name}"
+    with limiters_lock:
+        if name not in limiters:
+            limiters[name] = Limiter(name, **BACKEND_LIMITS.get(backend, {}))
+        return limiters[name]
+
+
+def call_deadline(context) -> float:
+    return time.time() + (context.get("timeout") or DEFAULT_DEADLINE)
+
+
+def limited_call(backend: str, call):
+    """
+    Wrap a blocking backend call with the backend/model limiter, retries and a deadline.
+    """
+    def limited(context):
+        limiter = get_limiter(backend, context["model_name"])
+        deadline = call_deadline(context)
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            lease = limiter.acquire(estimate_tokens(context), deadline)
+            queue_ms = (time.perf_counter() - queued_at) * 1000
+            if queue_ms >= 50:
+                logger.log(f"Limiter {limiter.name}: queued {queue_ms:.0f} ms")
+            # Each attempt only gets the time left before the deadline
+            attempt_context = {**context, "timeout": max(1.0, deadline - time.time())}
+            try:
+                response = call(attempt_context)
+            except Exception as e:
+                limiter.release(lease, attempt_context.get("used_tokens"))
+                attempt += 1
+                if not retry_or_raise(limiter, e, attempt, deadline):
+                    raise
+                continue
+            limiter.release(lease, attempt_context.get("used_tokens"))
+            logger.record_metric("limiter", limiter=limiter.name, queue_ms=round(queue_ms, 1), retries=attempt, used_tokens=attempt_context.get("used_tokens"))
+            return response
+    return limited
+
+
+def limited_stream(backend: str, stream_call):
+    """
+    Streaming counterpart of `limited_call`. A stream is only retried if it failed before its first
+    chunk, and its in-flight slot is held until the stream ends or is closed.
+    """
+    def limited(context):
+        limiter = get_limiter(backend, context["model_name"])
+        deadline = call_deadline(context)
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            lease = limiter.acquire(estimate_tokens(context), deadline)
+            queue_ms = (time.perf_counter() - queued_at) * 1000
+            if queue_ms >= 50:
+                logger.log(f"Limiter {limiter.name}: queued {queue_ms:.0f} ms")
+            started = False
+            attempt_context = {**context, "timeout": max(1.0, deadline - time.time())}
+            try:
+                for text in stream_call(attempt_context):
+                    started = True
+                    yield text
+            except Exception as e:
+                limiter.release(lease, attempt_context.get("used_tokens"))
+                attempt += 1
+                if started or not retry_or_raise(limiter, e, attempt, deadline):
+                    raise
+                continue
+            except BaseException:
+                # Closed by the consumer (GeneratorExit) or interrupted
+                limiter.release(lease, attempt_context.get("used_tokens"))
+                raise
+            limiter.release(lease, attempt_context.get("used_tokens"))
+            logger.record_metric("limiter", limiter=limiter.name, queue_ms=round(queue_ms, 1), retries=attempt, used_tokens=attempt_context.get("used_tokens"))
+            return
+    return limited
+
+
+def retry_or_raise(limiter: Limiter, error, attempt: int, deadline: float) -> bool:
+    """
+    Sleep before the next attempt and return True, or return False when the error should be raised.
+    """
+    if attempt >= MAX_ATTEMPTS or not is_retryable(error):
+        return False
+    delay = backoff_delay(attempt, error)
+    if time.time() + delay >= deadline:
+        logger.log(f"Limiter {limiter.name}: giving up after {attempt} attempts, deadline reached: {error}")
+        return False
+    server_delay = retry_after(error)
+    if server_delay is not None:
+        # Everyone using this backend/model should hold off, not just this caller
+        limiter.block(server_delay)
+    logger.log(f"Limiter {limiter.name}: retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.1f} s after {type(error).__name__}: {error}")
+    time.sleep(delay)
+    return True
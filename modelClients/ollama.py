@@ -1,24 +1,69 @@
-from typing import Dict
+import os
+import time
+from typing import Dict, Iterator
 
-from ollama import Client
+import logger
+from lazyload import lazy_import
+import tracing
 
 # Server configuration
 # OLLAMA_SERVER_HOSTNAME = "laptop-slicer"
 OLLAMA_SERVER_HOSTNAME = "localhost"
 OLLAMA_SERVER_PORT = "11434"  # Replace if Ollama uses a different port
+# Seconds before a request is abandoned (includes loading the model)
+OLLAMA_TIMEOUT = 300
+# How long the server keeps a model loaded after its last request (Ollama duration string or seconds).
+# Every call refreshes it, so the model stays resident while SelfAutomate is in use and is freed when idle.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "15m")
+# A load_duration above this means the model had to be loaded from disk
+COLD_LOAD_THRESHOLD_MS = 500
 
 # Model configuration
 # MODEL_NAME = "llama3.2-vision"
 # MODEL_NAME = "llava-phi3"
 # MODEL_NAME = "minicpm-v"
 
-client = Client(host=f'http://{OLLAMA_SERVER_HOSTNAME}:{OLLAMA_SERVER_PORT}')
+client = None
 
+def get_client():
+    global client
+    if client is None:
+        Client = lazy_import("ollama").Client
+        client = Client(host=f'http://{OLLAMA_SERVER_HOSTNAME}:{OLLAMA_SERVER_PORT}', timeout=OLLAMA_TIMEOUT)
+    return client
 
-def send_to_ollama(context: Dict[str, str]) -> str:
+
+def log_load(kind: str, model_name: str, response) -> None:
+    """
+    Log whether a request found its model loaded (warm) or had to load it (cold), from the server's timings.
+    """
+    load_ms = (response.get('load_duration') or 0) / 1e6
+    total_ms = (response.get('total_duration') or 0) / 1e6
+    cold = load_ms > COLD_LOAD_THRESHOLD_MS
+    logger.log(f"Ollama {kind} for {model_name}: {'cold' if cold else 'warm'}, load {load_ms:.0f} ms, total {total_ms:.0f} ms")
+    logger.record_metric("ollama_load", kind=kind, model=model_name, cold=cold, load_ms=round(load_ms, 1), total_ms=round(total_ms, 1))
+
+
+def preload_model(model_name: str, keep_alive=OLLAMA_KEEP_ALIVE) -> bool:
+    """
+    Load `model_name` into the server's memory (an empty generate request) and set its keep-alive.
+    Returns True if it had to be loaded.
+    """
+    start_time = time.perf_counter()
+    loaded = [model.get("name") for model in get_client().ps().get("models", [])]
+    if model_name in loaded or f"{model_name}:latest" in loaded:
+        # Already resident: a bare request only refreshes the keep-alive
+        get_client().generate(model=model_name, keep_alive=keep_alive)
+        logger.log(f"Ollama model {model_name} already loaded, keep-alive refreshed in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        return False
+    response = get_client().generate(model=model_name, keep_alive=keep_alive)
+    log_load("preload", model_name, response)
+    return True
+
+
+def build_message(context: Dict[str, str]) -> dict:
     prompt = context["prompt"]
     encoded_image = context["encoded_image"]
-    model_name = context["model_name"]
     
     chat_content = {
         'role': 'user',
@@ -28,11 +73,52 @@ def send_to_ollama(context: Dict[str, str]) -> str:
         chat_content["content"] = prompt
     if encoded_image:
         chat_content["images"] = [encoded_image]
+    return chat_content
+
+
+def record_usage(context: Dict[str, str], response) -> None:
+    # Prompt and completion tokens for the rate limiter (see ModelClients.limiter)
+    if response.get('eval_count') is not None:
+        context["used_tokens"] = (response.get('prompt_eval_count') or 0) + response['eval_count']
 
-    response = client.chat(
-        model=model_name,
+
+@tracing.traced("ollama.send")
+def send_to_ollama(context: Dict[str, str]) -> str:
+    response = get_client().chat(
+        model=context["model_name"],
         messages=[
-            chat_content,
-        ]
+            build_message(context),
+        ],
+        keep_alive=OLLAMA_KEEP_ALIVE,
     )
+    log_load("chat", context["model_name"], response)
+    record_usage(context, response)
     return response['message']['content']
+
+
+@tracing.traced("ollama.stream")
+def stream_ollama(context: Dict[str, str]) -> Iterator[str]:
+    """
+    Yield the completion text as it arrives. Setting `context["cancel_event"]` closes the stream.
+    """
+    cancel_event = context.get("cancel_event")
+    stream = get_client().chat(
+        model=context["model_name"],
+        messages=[
+            build_message(context),
+        ],
+        stream=True,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
+    try:
+        for part in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if part['message']['content']:
+                yield part['message']['content']
+            if part.get('done'):
+                log_load("chat", context["model_name"], part)
+                record_usage(context, part)
+    finally:
+        stream.close()
+
@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+
+import logger
+
+ROUTER_STATS_FILE = "router_stats.json"
+
+
+class BackendStats:
+    '''
+    Rolling (exponentially weighted) latency and error estimate for one backend/model.
+    '''
+    def __init__(self, latency_ms=None, error_rate=0.0, calls=0, alpha=0.3):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.calls = calls
+        self.alpha = alpha
+
+    def record(self, latency_ms=None, error=False):
+        self.calls += 1
+        self.error_rate += self.alpha * ((1.0 if error else 0.0) - self.error_rate)
+        if latency_ms is not None:
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.alpha * (latency_ms - self.latency_ms)
+
+    def score(self):
+        """
+        Expected cost of a call, or None before the first successful call. Errors inflate it.
+        """
+        if self.latency_ms is None:
+            return None
+        return self.latency_ms * (1 + 4 * self.error_rate)
+
+    def to_dict(self):
+        return {"latency_ms": self.latency_ms, "error_rate": self.error_rate, "calls": self.calls}
+
+    def __str__(self):
+        latency = f"{self.latency_ms:.0f} ms" if self.latency_ms is not None else "n/a"
+        return f"latency {latency}, errors {self.error_rate:.0%}, calls {self.calls}"
+
+
+def target_name(target) -> str:
+    return f"{target['backend']}/{target['model_name']}"
+
+
+class Router:
+    '''
+    Routes a command to the currently fastest of several backend targets
+    ({"backend": ..., "model_name": ...}). It can hedge by starting the next target when
+    the first has not answered within `hedge_after` seconds, and falls back on errors.
+    Stats are persisted under LOG_DIR so short-lived UI processes share what they learned.
+    '''
+    def __init__(self, stats_file=ROUTER_STATS_FILE):
+        self.stats_file = stats_file
+        self.lock = threading.Lock()
+        self.stats = {}
+        for name, values in logger.access_runtime_config(self.stats_file).items():
+            try:
+                self.stats[name] = BackendStats(**values)
+            except TypeError:
+                # Entries from an incompatible version just start over
+                logger.log(f"Ignoring unreadable router stats for {name}: {values}")
+
+    def get_stats(self, target) -> BackendStats:
+        return self.stats.setdefault(target_name(target), BackendStats())
+
+    def record(self, target, latency_ms=None, error=False):
+        with self.lock:
+            stats = self.get_stats(target)
+            stats.record(latency_ms, error)
+            logger.log(f"Backend {target_name(target)}: {stats}")
+            logger.access_runtime_config(self.stats_file, {name: value.to_dict() for name, value in self.stats.items()})
+
+    def rank(self, targets) -> list:
+        """
+        Targets ordered by expected latency; targets without data keep their configured order after known ones.
+        """
+        with self.lock:
+            def key(indexed_target):
+                index, target = indexed_target
+                score = self.get_stats(target).score()
+                return (score is None, score or 0, index)
+            return [target for _, target in sorted(enumerate(targets), key=key)]
+
+    def stream(self, targets, context, get_stream_call, hedge_after=None, cancel_event=None):
+        """
+        Yield the response text from the first target to answer.
+        `get_stream_call(backend)` returns the backend's streaming call.
+        The target that answered is reported in context["routed_target"], so callers can attribute the response.
+        """
+        ranked = self.rank(targets)
+        events = queue.Queue()
+        active = {}
+        next_index = 0
+        winner = None
+
+        def start_next(reason):
+            nonlocal next_index
+            index = next_index
+            target = ranked[index]
+            next_index += 1
+            target_cancel = threading.Event()
+            target_context = {**context, "model_name": target["model_name"], "cancel_event": target_cancel}
+            active[index] = (target, target_cancel, time.perf_counter())
+            logger.log(f"Routing to {target_name(target)} ({reason})")
+
+            def pump():
+                try:
+                    for text in get_stream_call(target["backend"])(target_context):
+                        events.put((index, "token", text))
+                    events.put((index, "done", None))
+                except Exception as e:
+                    events.put((index, "error", e))
+            threading.Thread(target=pump, name=f"route-{target_name(target)}", daemon=True).start()
+
+        start_next("fastest" if self.get_stats(ranked[0]).score() is not None else "default")
+        hedge_deadline = time.perf_counter() + hedge_after if hedge_after is not None and len(ranked) > 1 else None
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                wait = None
+                if winner is None and hedge_deadline is not None and next_index < len(ranked):
+                    wait = max(0.0, hedge_deadline - time.perf_counter())
+                if cancel_event is not None:
+                    wait = 0.2 if wait is None else min(wait, 0.2)
+                try:
+                    index, kind, payload = events.get(timeout=wait)
+                except queue.Empty:
+                    if winner is None and hedge_deadline is not None and time.perf_counter() >= hedge_deadline and next_index < len(ranked):
+                        hedge_deadline = None
+                        start_next(f"hedge after {hedge_after} s")
+                    continue
+                if index not in active or (winner is not None and index != winner):
+                    # Leftovers from a cancelled loser
+                    continue
+                target, _, start_time = active[index]
+                if kind == "error":
+                    del active[index]
+                    self.record(target, error=True)
+                    logger.log(f"Backend {target_name(target)} failed: {payload}")
+                    if winner == index:
+                        raise payload
+                    if not active:
+                        if next_index >= len(ranked):
+                            raise payload
+                        start_next("fallback")
+                    continue
+                if winner is None:
+                    winner = index
+                    context["routed_target"] = target
+                    for other_index, (other_target, other_cancel, _) in active.items():
+                        if other_index != index:
+                            other_cancel.set()
+                            logger.log(f"Cancelled slower backend {target_name(other_target)}")
+                if kind == "token":
+                    yield payload
+                else:
+                    self.record(target, latency_ms=(time.perf_counter() - start_time) * 1000)
+                    return
+        finally:
+            for _, target_cancel, _ in active.values():
+                target_cancel.set()
+
+
+router = None
+
+def get_router() -> Router:
+    global router
+    if router is None:
+        router = Router()
+    return router
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+
+import logger
+from utils import submit_background
+
+USAGE_FILE = "command_usage.json"
+SPECULATION_ENABLED = os.getenv("SPECULATION", "1").lower() in ("1", "true", "yes")
+# Backends billed per call. Speculative calls to them are skipped unless explicitly allowed,
+# since a wrong guess costs money (encoding is still done speculatively).
+PAID_BACKENDS = {"groq"}
+SPECULATE_PAID_BACKENDS = os.getenv("SPECULATE_PAID_BACKENDS", "0").lower() in ("1", "true", "yes")
+# Only guess once there is some history and one command clearly dominates it
+MIN_USES = 5
+MIN_SHARE = 0.5
+
+
+class CommandUsage:
+    '''
+    Per-command pick counts and speculation hit/miss statistics, kept under LOG_DIR.
+    '''
+    def __init__(self, usage_file=USAGE_FILE):
+        self.usage_file = usage_file
+        self.lock = threading.Lock()
+
+    def load(self) -> dict:
+        usage = logger.access_runtime_config(self.usage_file)
+        counts = usage.get("counts")
+        stats = usage.get("speculation")
+        # Anything malformed starts over rather than breaking region selection
+        if not isinstance(counts, dict) or not all(isinstance(count, int) for count in counts.values()):
+            usage["counts"] = {}
+        if not isinstance(stats, dict) or not all(isinstance(stats.get(key), (int, float)) for key in ("hits", "misses", "saved_ms")):
+            usage["speculation"] = {"hits": 0, "misses": 0, "saved_ms": 0.0}
+        return usage
+
+    def update(self, apply):
+        try:
+            with self.lock:
+                usage = self.load()
+                apply(usage)
+                logger.access_runtime_config(self.usage_file, usage)
+        except Exception as e:
+            logger.log_error(e, f"Could not update {self.usage_file}")
+
+    def record_pick(self, command):
+        def apply(usage):
+            usage["counts"][command.display_string] = usage["counts"].get(command.display_string, 0) + 1
+        self.update(apply)
+
+    def record_speculation(self, hit: bool, saved_ms: float = 0.0):
+        def apply(usage):
+            stats = usage["speculation"]
+            stats["hits" if hit else "misses"] += 1
+            stats["saved_ms"] += saved_ms
+            total = stats["hits"] + stats["misses"]
+            logger.log(f"Speculation {'hit' if hit else 'miss'} (saved {saved_ms:.0f} ms): hit rate {stats['hits'] / total:.0%} over {total}, {stats['saved_ms'] / 1000:.1f} s saved in total")
+        self.update(apply)
+        logger.record_metric("speculation", hit=hit, saved_ms=round(saved_ms, 1))
+
+    def likely_command(self, commands):
+        """
+        The command picked most often, if it accounts for at least MIN_SHARE of MIN_USES or more picks.
+        """
+        counts = self.load()["counts"]
+        total = sum(counts.get(command.display_string, 0) for command in commands)
+        if total < MIN_USES:
+            return None
+        command = max(commands, key=lambda command: counts.get(command.display_string, 0))
+        return command if counts.get(command.display_string, 0) >= MIN_SHARE * total else None
+
+
+def is_paid(command) -> bool:
+    return any(target["backend"] in PAID_BACKENDS for target in command.targets)
+
+
+class TokenRelay:
+    '''
+    Buffers streamed text until a consumer attaches, then replays it and forwards the rest.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parts = []
+        self.consumer = None
+
+    def put(self, text):
+        with self.lock:
+            if self.consumer is None:
+                self.parts.append(text)
+                return
+            consumer = self.consumer
+        consumer(text)
+
+    def attach(self, consumer):
+        with self.lock:
+            for text in self.parts:
+                consumer(text)
+            self.parts = []
+            self.consumer = consumer
+
+
+class Speculation:
+    '''
+    Work started as soon as a region is selected: the crop is encoded for every encoding the commands
+    use, and the likely command may already be dispatched. `claim` hands a running call to the UI if the
+    user picks that command; anything unclaimed is cancelled.
+    '''
+    def __init__(self, image, commands, usage: CommandUsage, timeout=None):
+        self.image = image
+        self.usage = usage
+        self.started_at = time.perf_counter()
+        self.encodings = {}
+        for command in commands:
+            key = encoding_key(command)
+            if key not in self.encodings and not command.needs_tiling(image):
+                self.encodings[key] = submit_background(command.encode_image, image)
+
+        self.command = None
+        self.future = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.relay = TokenRelay()
+        likely = usage.likely_command(commands)
+        if likely is not None and (SPECULATE_PAID_BACKENDS or not is_paid(likely)):
+            self.command = likely
+            logger.log(f"Speculatively running {likely}")
+            self.future = submit_background(self.run_likely, timeout)
+
+    def run_likely(self, timeout):
+        try:
+            return self.command.invoke_with_image(
+                self.image,
+                copy_to_clipboard=False,
+                timeout=timeout,
+                on_token=self.relay.put,
+                cancel_event=self.cancel_event,
+                encoded=self.encoded_for(self.command),
+            )
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def encoded_for(self, command):
+        """
+        The speculative encoding for `command` (waiting for it if still running), or None.
+        """
+        future = self.encodings.get(encoding_key(command))
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.log(f"Speculative encoding failed for {command}: {e}")
+            return None
+
+    def claim(self, command, on_token=None):
+        """
+        Take over the speculative call if it is for `command`: returns (future, cancel_event), else None.
+        A different pick cancels the speculative call.
+        """
+        if self.future is None:
+            return None
+        if command is not self.command:
+            self.cancel()
+            self.usage.record_speculation(hit=False)
+            return None
+        claimed_at = time.perf_counter()
+        # Time the call already ran before the click, i.e. latency the user no longer waits for
+        saved_ms = ((self.finished_at or claimed_at) - self.started_at) * 1000
+        self.usage.record_speculation(hit=True, saved_ms=saved_ms)
+        if on_token is not None:
+            self.relay.attach(on_token)
+        return self.future, self.cancel_event
+
+    def cancel(self):
+        if self.future is not None and not self.future.done():
+            logger.log(f"Cancelled speculative {self.command}")
+        self.cancel_event.set()
+        self.future = None
+
+
+def encoding_key(command):
+    return repr(sorted(command.encoding.items()))
+
+
+usage = None
+
+def get_command_usage() -> CommandUsage:
+    global usage
+    if usage is None:
+        usage = CommandUsage()
+    return usage
+
+
+def start_speculation(image, commands, timeout=None):
+    """
+    Start speculative work for a selection, or return None. A failure only disables speculation.
+    """
+    if not SPECULATION_ENABLED:
+        return None
+    try:
+        return Speculation(image, commands, get_command_usage(), timeout)
+    except Exception as e:
+        logger.log_error(e, "Speculation failed to start")
+        return None
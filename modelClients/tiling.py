@@ -0,0 +1,127 @@
+import math
+import re
+from difflib import SequenceMatcher
+
+# Matched lines shorter than this (after normalizing) are not treated as overlap on their own,
+# so repeated short lines such as "}" or "-" survive the merge
+MIN_OVERLAP_CHARS = 8
+
+
+def tile_positions(length: int, tile_size: int, overlap: int) -> list:
+    """
+    Start offsets of tiles covering `length` pixels, spread evenly so every tile overlaps the next by at least `overlap`.
+    """
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    step = (length - tile_size) / (count - 1)
+    return [round(index * step) for index in range(count)]
+
+
+def grid_span(count: int, tile_size: int, overlap: int) -> int:
+    """
+    Pixels covered by `count` tiles that overlap by `overlap`.
+    """
+    return count * (tile_size - overlap) + overlap
+
+
+def grid_scale(width: int, height: int, tile_size: int, overlap: int, max_tiles: int) -> float:
+    """
+    Factor to resize an image by before cutting it into tiles: the largest (at most 1) for which some
+    grid of at most `max_tiles` tiles covers it. Images that fit no such grid natively are downsampled.
+    """
+    best = 0.0
+    for columns in range(1, max_tiles + 1):
+        for rows in range(1, max_tiles // columns + 1):
+            scale = min(1.0, grid_span(columns, tile_size, overlap) / width, grid_span(rows, tile_size, overlap) / height)
+            best = max(best, scale)
+    return best
+
+
+def band_boxes(width: int, height: int, tile_size: int, overlap: int) -> list:
+    """
+    Crop boxes (left, top, right, bottom) of full-width bands, top to bottom, each overlapping the next vertically.
+    """
+    return [(0, top, width, min(top + tile_size, height)) for top in tile_positions(height, tile_size, overlap)]
+
+
+def tile_boxes(width: int, height: int, tile_size: int, overlap: int) -> list:
+    """
+    Crop boxes as rows of tiles: each band of `band_boxes` cut into overlapping tiles, left to right.
+    """
+    return [
+        [(left, top, min(left + tile_size, width), bottom) for left in tile_positions(width, tile_size, overlap)]
+        for _, top, _, bottom in band_boxes(width, height, tile_size, overlap)
+    ]
+
+
+def normalize_line(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def similar(a: str, b: str, threshold: float = 0.9) -> bool:
+    if a == b:
+        return True
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= threshold
+
+
+def strip_leading_overlap(previous_lines: list, lines: list, max_lines: int = 60) -> list:
+    """
+    Drop the leading lines of `lines` that repeat the trailing lines of `previous_lines`
+    (text in the overlap band between a tile and the one above it).
+    """
+    previous = [normalize_line(line) for line in previous_lines if line.strip()]
+    current = [normalize_line(line) for line in lines]
+    content_indexes = [index for index, line in enumerate(current) if line]
+    for count in range(min(max_lines, len(previous), len(content_indexes)), 0, -1):
+        head = [current[index] for index in content_indexes[:count]]
+        tail = previous[-count:]
+        if sum(len(line) for line in head) >= MIN_OVERLAP_CHARS and all(similar(a, b) for a, b in zip(head, tail)):
+            return lines[content_indexes[count - 1] + 1:]
+    return lines
+
+
+def join_line_parts(left: str, right: str, max_words: int = 8) -> str:
+    """
+    Join the left and right parts of one line, dropping the leading words of `right` that repeat
+    the trailing words of `left` (text in the overlap band between two tiles of a row).
+    """
+    left_words, right_words = left.split(), right.split()
+    for count in range(min(max_words, len(left_words), len(right_words)), 0, -1):
+        head = " ".join(right_words[:count]).lower()
+        if len(head) >= MIN_OVERLAP_CHARS // 2 and similar(head, " ".join(left_words[-count:]).lower()):
+            right_words = right_words[count:]
+            break
+    return " ".join(left_words + right_words)
+
+
+def merge_row(texts: list) -> list:
+    """
+    Merge the transcriptions of one row of tiles, left to right, into lines. When every tile read the
+    same number of lines they are the same lines cut at the tile edges, so they are joined line by line;
+    otherwise the tiles' lines follow each other.
+    """
+    if len(texts) == 1:
+        return (texts[0] or "").strip("\n").splitlines()
+    columns = [[line for line in (text or "").splitlines() if line.strip()] for text in texts]
+    columns = [lines for lines in columns if lines]
+    if not columns:
+        return []
+    if len({len(lines) for lines in columns}) == 1:
+        merged = columns[0]
+        for lines in columns[1:]:
+            merged = [join_line_parts(left, right) for left, right in zip(merged, lines)]
+        return merged
+    return [line for lines in columns for line in lines]
+
+
+def merge_tile_texts(rows: list, max_overlap_lines: int = 60) -> str:
+    """
+    Merge tile transcriptions, given as rows of texts in the layout of `tile_boxes`, in reading order:
+    each row is merged into whole lines first, then the rows are joined top to bottom with the text
+    repeated across the overlap between rows removed.
+    """
+    merged = []
+    for row in rows:
+        merged.extend(strip_leading_overlap(merged, merge_row(row), max_overlap_lines))
+    return "\n".join(merged).strip("\n")
@@ -1,6 +1,5 @@
-import time
 import os
-from queue import Queue
+import time
 
 from pynput.keyboard import GlobalHotKeys
 
@@ -8,8 +7,18 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import logger
+import tracing
 
+from capture import screen_capture, SharedFrame
 from Processes import ProcessManager, PROCESS_TYPE_MAP
+from dispatcher import SignalDispatcher, END_SIGNAL
+
+# Must stay below the time_delta passed to allow_running_instance at startup
+HEARTBEAT_INTERVAL = 1.0
+# Pause before capturing when a re-trigger just closed an open UI window (a couple of display frames)
+CAPTURE_SETTLE_SECONDS = 0.05
+# Background process types started with SelfAutomate
+BACKGROUND_PROCESSES = ["screen_history"] if os.getenv("SCREEN_HISTORY", "0").lower() in ("1", "true", "yes") else []
 
 
 def main():
@@ -31,50 +40,61 @@ def main():
     logger.log("Starting SelfAutomate")
     
     pm = ProcessManager()
+    dispatcher = SignalDispatcher()
 
-    # Start the Hotkey listener with message passing
-    q = Queue()
-    def get_process_signal_listener(signal_key: str):
-        def start_signal():
-            q.put(signal_key)
-        return start_signal
-    
+    # Hotkeys only enqueue signals; the dispatcher hands them to the ProcessManager
     hotkeyMap = {
-        pt.hotkey: get_process_signal_listener(pt.key) for pt in PROCESS_TYPE_MAP.values()
+        pt.hotkey: dispatcher.signal_listener(pt.key) for pt in PROCESS_TYPE_MAP.values() if pt.hotkey is not None
     }
-    hotkeyMap['<cmd>+<shift>+0'] = get_process_signal_listener("end_signal")
+    hotkeyMap['<cmd>+<shift>+0'] = dispatcher.signal_listener(END_SIGNAL)
+
+    def capture_args(replaced):
+        # The screen as the user saw it when pressing the hotkey, not once the UI is up
+        if replaced:
+            # Let the window server drop the terminated instance's window
+            time.sleep(CAPTURE_SETTLE_SECONDS)
+        try:
+            with tracing.span("capture"):
+                return (SharedFrame.share(screen_capture.grab()),)
+        except Exception as e:
+            logger.log_error(e, "Capture at trigger failed, the process will capture itself")
+            return ()
+
+    def reset_process(signal, trigger_time):
+        # Each trigger starts a trace; the root span also covers the wait in the dispatch queue
+        with tracing.start_trace("hotkey", start_time=trigger_time, signal=signal):
+            capture = capture_args if PROCESS_TYPE_MAP[signal].capture_on_trigger else None
+            pm.reset_process(signal, trigger_time=trigger_time, trace_id=tracing.current_trace_id(), capture=capture)
+
+    for key in PROCESS_TYPE_MAP:
+        dispatcher.on(key, reset_process)
+
+    def heartbeat():
+        if not logger.allow_running_instance():
+            logger.log("SelfAutomate delayed termination")
+            dispatcher.stop()
     
     try:
         # Register hotkeys
         hotkeyListener = GlobalHotKeys(hotkeyMap)
         hotkeyListener.start()
 
-        # Background processes
-        # None for now - Use pm.create_process
+        # Pre-warm pooled workers so hotkeys skip the import cost of a fresh process
+        pm.start_pools()
+        # Open the capture handle on the dispatch thread, where hotkey captures are taken
+        dispatcher.executor.submit(lambda: screen_capture.monitors)
+
+        dispatcher.every(HEARTBEAT_INTERVAL, heartbeat, name="heartbeat")
+
+        # Background processes, started on the dispatch thread like every other ProcessManager change
+        for name in BACKGROUND_PROCESSES:
+            dispatcher.executor.submit(dispatcher.dispatch, lambda name, _: pm.reset_process(name), name, time.time())
 
-        # Signal loop
-        loop_delayer = 5
         # Wait for the signal to trigger UI launch
-        while True:
-            if not q.empty():
-                signal = q.get()
-                logger.log(f"Received process signal: {signal}")
-                if signal in PROCESS_TYPE_MAP:
-                    pm.reset_process(signal)
-                elif signal == "end_signal":
-                    break
-                else:
-                    continue
-            else:
-                time.sleep(0.2)
-            loop_delayer -= 1
-            if loop_delayer == 0:
-                loop_delayer = 5
-                if not logger.allow_running_instance():
-                    logger.log("SelfAutomate delayed termination")
-                    break
+        dispatcher.run()
     finally:
         logger.log("Terminating SelfAutomate")
+        dispatcher.shutdown()
         pm.terminate_all()
         hotkeyListener.stop()
         logger.terminate_running_instance()
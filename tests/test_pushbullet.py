@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp())
+
+import logger
+from benchmarks.stubs import PushbulletStub, STUB_DEVICE_IDEN
+from Processes import pushbullet
+
+WAIT_INTERVAL = 1.5
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for condition")
+        time.sleep(0.01)
+
+
+class ListenRealtimeTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = PushbulletStub()
+        self.config_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.config_dir.name, "pushbullet.json")
+        with open(config_path, "w") as f:
+            json.dump({"api_key": "stub-key", "device": {"iden": STUB_DEVICE_IDEN}}, f)
+        try:
+            os.remove(os.path.join(logger.LOG_DIR, "pushbullet_last_push_timestamp.json"))
+        except FileNotFoundError:
+            pass
+        self.patcher = mock.patch.multiple(
+            pushbullet,
+            STREAM_RECV_TIMEOUT=5,
+            STREAM_MIN_BACKOFF=0.1,
+            STREAM_FALLBACK_INTERVAL=1,
+            POLL_MIN_INTERVAL=0.05,
+            POLL_MAX_INTERVAL=0.2,
+        )
+        self.patcher.start()
+        self.received = []
+        self.wrapper = pushbullet.PushbulletWrapper(config_path, api_url=self.stub.api_url, stream_url=self.stub.stream_url)
+        self.thread = None
+
+    def tearDown(self):
+        self.stub.close()
+        if self.thread is not None:
+            self.thread.join(15)
+            self.assertFalse(self.thread.is_alive(), "listen_realtime did not return")
+        self.patcher.stop()
+        self.config_dir.cleanup()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.wrapper.listen_realtime, args=(self.received.append, WAIT_INTERVAL), daemon=True)
+        self.thread.start()
+
+    def test_tickle_fetches_pushes(self):
+        self.start()
+        # Connecting fetches once to catch up
+        wait_for(lambda: self.stub.connections == 1 and self.stub.fetches == 1)
+        self.stub.add_push(body="hello")
+        wait_for(lambda: len(self.received) == 1)
+        self.assertEqual(self.received[0]["body"], "hello")
+        self.assertEqual(self.stub.fetches, 2)
+
+    def test_reconnects_with_backoff(self):
+        with mock.patch.object(pushbullet, "STREAM_MAX_FAILURES", 5):
+            self.start()
+            wait_for(lambda: self.stub.connections == 1 and self.stub.fetches == 1)
+            self.stub.accept_stream = False
+            self.stub.drop_stream()
+            wait_for(lambda: len(self.stub.stream_attempts) == 3)
+            self.stub.accept_stream = True
+            wait_for(lambda: self.stub.connections == 2)
+            self.stub.add_push(body="after reconnect")
+            wait_for(lambda: len(self.received) == 1)
+        first_retry, second_retry = (later - earlier for earlier, later in zip(self.stub.stream_attempts[1:], self.stub.stream_attempts[2:]))
+        # Each failed attempt doubles the wait before the next one
+        self.assertGreaterEqual(first_retry, 2 * pushbullet.STREAM_MIN_BACKOFF * 0.9)
+        self.assertGreaterEqual(second_retry, 4 * pushbullet.STREAM_MIN_BACKOFF * 0.9)
+        self.assertEqual(self.received[0]["body"], "after reconnect")
+
+    def test_falls_back_to_polling(self):
+        self.stub.accept_stream = False
+        with mock.patch.object(pushbullet, "STREAM_MAX_FAILURES", 2):
+            self.start()
+            wait_for(lambda: len(self.stub.stream_attempts) == 2)
+            wait_for(lambda: self.stub.fetches >= 1)
+            self.stub.add_push(body="polled")
+            wait_for(lambda: len(self.received) == 1)
+        self.assertEqual(self.received[0]["body"], "polled")
+        self.assertEqual(self.stub.connections, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp())
+
+from modelClients.tiling import band_boxes, grid_scale, merge_tile_texts, strip_leading_overlap, tile_boxes
+
+TILE = 1120
+OVERLAP = 96
+
+
+class TileLayoutTest(unittest.TestCase):
+    def test_band_boxes_cover_the_image_with_overlap(self):
+        boxes = band_boxes(1000, 2300, TILE, OVERLAP)
+        self.assertEqual(len(boxes), 3)
+        self.assertEqual(boxes[0][1], 0)
+        self.assertEqual(boxes[-1][3], 2300)
+        for box in boxes:
+            self.assertEqual((box[0], box[2]), (0, 1000))
+            self.assertLessEqual(box[3] - box[1], TILE)
+        for upper, lower in zip(boxes, boxes[1:]):
+            self.assertGreaterEqual(upper[3] - lower[1], OVERLAP)
+
+    def test_band_boxes_single_band_when_it_fits(self):
+        self.assertEqual(band_boxes(1920, 800, TILE, OVERLAP), [(0, 0, 1920, 800)])
+
+    def test_tile_boxes_rows_split_into_columns(self):
+        rows = tile_boxes(2144, 2144, TILE, OVERLAP)
+        self.assertEqual([len(row) for row in rows], [2, 2])
+        self.assertEqual(rows[0], [(0, 0, 1120, 1120), (1024, 0, 2144, 1120)])
+        self.assertEqual(rows[1][1], (1024, 1024, 2144, 2144))
+
+    def test_grid_scale_reads_full_screens_above_single_call_resolution(self):
+        # One call would shrink a 4K screen to 1120 / 3840 of its size
+        for width, height in [(1920, 1080), (3840, 2160), (5120, 2880)]:
+            scale = grid_scale(width, height, TILE, OVERLAP, 4)
+            self.assertGreater(scale, TILE / width * 1.5)
+            rows = tile_boxes(round(width * scale), round(height * scale), TILE, OVERLAP)
+            self.assertLessEqual(sum(len(row) for row in rows), 4)
+        self.assertEqual(grid_scale(1920, 1080, TILE, OVERLAP, 4), 1.0)
+
+    def test_grid_scale_keeps_tall_crops_at_native_width(self):
+        self.assertEqual(grid_scale(1000, 2300, TILE, OVERLAP, 4), 1.0)
+        self.assertLess(grid_scale(1000, 20000, TILE, OVERLAP, 4), 1.0)
+
+
+class StripLeadingOverlapTest(unittest.TestCase):
+    def test_drops_lines_repeated_from_the_tile_above(self):
+        above = ["first paragraph line", "shared line one", "shared line two"]
+        lines = ["shared line one", "shared line two", "new content below"]
+        self.assertEqual(strip_leading_overlap(above, lines), ["new content below"])
+
+    def test_tolerates_small_ocr_differences(self):
+        above = ["intro", "The quick brown fox jumps"]
+        lines = ["The quick brown f0x jumps", "over the lazy dog"]
+        self.assertEqual(strip_leading_overlap(above, lines), ["over the lazy dog"])
+
+    def test_keeps_lines_without_overlap(self):
+        lines = ["something else entirely", "and more"]
+        self.assertEqual(strip_leading_overlap(["unrelated text above"], lines), lines)
+
+    def test_keeps_short_repeated_lines(self):
+        # A lone "}" matching the line above is not evidence of overlap
+        self.assertEqual(strip_leading_overlap(["    return x", "}"], ["}", "next()"]), ["}", "next()"])
+
+    def test_skips_blank_lines(self):
+        above = ["heading", "", "a line in the overlap band"]
+        lines = ["", "a line in the overlap band", "", "below"]
+        self.assertEqual(strip_leading_overlap(above, lines), ["", "below"])
+
+
+class MergeTileTextsTest(unittest.TestCase):
+    def test_bands_merge_top_to_bottom(self):
+        rows = [["line one of the page\nline two of the page"], ["line two of the page\nline three of the page"]]
+        self.assertEqual(merge_tile_texts(rows), "line one of the page\nline two of the page\nline three of the page")
+
+    def test_row_tiles_join_into_whole_lines(self):
+        rows = [
+            ["The quick brown fox\nPack my box with", "brown fox jumps over\nbox with five dozen"],
+            ["last line of the screen"],
+        ]
+        self.assertEqual(
+            merge_tile_texts(rows),
+            "The quick brown fox jumps over\nPack my box with five dozen\nlast line of the screen",
+        )
+
+    def test_rows_are_merged_before_stripping_vertical_overlap(self):
+        rows = [
+            ["Heading on the left\nA shared row of", "on the left side\nrow of text here"],
+            ["A shared row of", "row of text here"],
+            ["Final row below"],
+        ]
+        self.assertEqual(
+            merge_tile_texts(rows),
+            "Heading on the left side\nA shared row of text here\nFinal row below",
+        )
+
+    def test_mismatched_columns_follow_each_other(self):
+        rows = [["left column only line", "right one\nright two"]]
+        self.assertEqual(merge_tile_texts(rows), "left column only line\nright one\nright two")
+
+    def test_empty_tiles_are_skipped(self):
+        self.assertEqual(merge_tile_texts([["", None], ["only text"]]), "only text")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+'''
+Lightweight spans for timing the hotkey -> capture -> encode -> model -> clipboard pipeline.
+
+Tracing is off unless TRACING=1 is set in the environment; when off, `span` returns a shared no-op
+object and `traced` leaves functions undecorated. Span records are JSON lines in LOG_DIR/trace.jsonl.
+Each hotkey trigger starts a trace in the parent (`start_trace`), and the trace ID is handed to the
+child process with its process args (`join_trace`), so all spans of one run share a trace ID.
+
+Summarize recent runs with: python tracing.py [number of traces]
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import functools
+import inspect
+import itertools
+import contextvars
+
+import logger
+
+TRACE_FILE = "trace.jsonl"
+TRACING_ENABLED = os.getenv("TRACING", "0").lower() in ("1", "true", "yes")
+
+trace_writer = logger.LogWriter(TRACE_FILE)
+atexit.register(trace_writer.flush)
+
+# Trace of this process (set by `start_trace` / `join_trace`), and the innermost open span of this context.
+# Threads without a span of their own attach their spans to the process trace at the top level.
+_process_trace_id = None
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def current_trace_id():
+    return _process_trace_id
+
+def join_trace(trace_id):
+    """
+    Attach spans recorded in this process to `trace_id` (received through the process args).
+    """
+    global _process_trace_id
+    if trace_id is not None:
+        _process_trace_id = trace_id
+
+
+class Span:
+    '''
+    A timed section of a trace. Use as a context manager; `set` adds attributes to the record.
+    '''
+    def __init__(self, name, start_time=None, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start_time = start_time
+        self.span_id = f"{os.getpid()}.{next(_span_ids)}"
+        self.parent_id = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent_id = _current_span.get()
+        _current_span.set(self.span_id)
+        now = time.time()
+        # An explicit start (e.g. the hotkey time) is carried over onto the perf counter clock
+        self.perf_start = time.perf_counter() - (now - self.start_time if self.start_time is not None else 0)
+        if self.start_time is None:
+            self.start_time = now
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Spans may close in another context (e.g. generators), so restore the parent rather than reset a token
+        _current_span.set(self.parent_id)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        write_span(self.name, self.span_id, self.parent_id, self.start_time, (time.perf_counter() - self.perf_start) * 1000, self.attrs)
+        return False
+
+
+class NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = NoopSpan()
+
+
+def write_span(name, span_id, parent_id, start_time, duration_ms, attrs):
+    record = {
+        "trace": _process_trace_id,
+        "span": span_id,
+        "parent": parent_id,
+        "name": name,
+        "pid": os.getpid(),
+        "start": round(start_time, 6),
+        "ms": round(duration_ms, 3),
+    }
+    if attrs:
+        record["attrs"] = attrs
+    trace_writer.submit(json.dumps(record, default=str) + "\n")
+
+
+def span(name, start_time=None, **attrs):
+    """
+    Time a block: `with span("encode", size=...) as s: ...`. `start_time` (epoch seconds) backdates the start.
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, start_time, **attrs)
+
+def start_trace(name, start_time=None, **attrs):
+    """
+    Begin a new trace in this process and return its root span.
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    global _process_trace_id
+    _process_trace_id = new_trace_id()
+    _current_span.set(None)
+    return Span(name, start_time, **attrs)
+
+def record_span(name, start_time, end_time=None, **attrs):
+    """
+    Record an already finished interval, e.g. from the hotkey time to the first painted frame.
+    """
+    if not TRACING_ENABLED:
+        return
+    end_time = time.time() if end_time is None else end_time
+    write_span(name, f"{os.getpid()}.{next(_span_ids)}", _current_span.get(), start_time, (end_time - start_time) * 1000, attrs)
+
+def traced(name=None):
+    """
+    Decorator wrapping each call in a span. Generator functions are timed until exhausted or closed.
+    With tracing disabled the function is returned unchanged.
+    """
+    def decorator(fn):
+        if not TRACING_ENABLED:
+            return fn
+        span_name = name or fn.__qualname__
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with Span(span_name) as s:
+                    chunks = 0
+                    for item in fn(*args, **kwargs):
+                        chunks += 1
+                        yield item
+                    s.set(chunks=chunks)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def load_spans(path=None):
+    path = path or os.path.join(logger.LOG_DIR, TRACE_FILE)
+    spans = []
+    # Include the most recent rotated file so a fresh rotation doesn't empty the summary
+    for file_path in (f"{path}.1", path):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "r") as file:
+            for line in file:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return spans
+
+def summarize(spans, last_traces=50):
+    """
+    Per span name: count, p50, p95 and max duration (ms) over the `last_traces` most recent traces.
+    """
+    trace_starts = {}
+    for record in spans:
+        if record.get("trace") is not None:
+            trace_starts[record["trace"]] = min(record["start"], trace_starts.get(record["trace"], record["start"]))
+    recent = set(sorted(trace_starts, key=trace_starts.get)[-last_traces:])
+    durations = {}
+    for record in spans:
+        if record.get("trace") in recent:
+            durations.setdefault(record["name"], []).append(record["ms"])
+    summary = {}
+    for span_name, values in durations.items():
+        values.sort()
+        summary[span_name] = {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": values[-1],
+        }
+    return len(recent), summary
+
+def report(last_traces=50, path=None):
+    trace_count, summary = summarize(load_spans(path), last_traces)
+    if not summary:
+        print("No traces recorded. Run with TRACING=1 to collect them.")
+        return
+    print(f"Span timings over the last {trace_count} traces (ms)")
+    print(f"{'span':<36}{'count':>7}{'p50':>11}{'p95':>11}{'max':>11}")
+    for span_name, stats in sorted(summary.items(), key=lambda item: -item[1]["p50"]):
+        print(f"{span_name:<36}{stats['count']:>7}{stats['p50']:>11.1f}{stats['p95']:>11.1f}{stats['max']:>11.1f}")
+
+
+if __name__ == "__main__":
+    report(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -1,26 +1,120 @@
 
+import os
 import subprocess
 import platform
+import tempfile
 
 import base64
+import threading
+import time
 from io import BytesIO
-import mss
-from PIL import Image
+from concurrent.futures import Future
 
 import logger
+import tracing
+from lazyload import lazy_import
+from capture import screen_capture
 
-def grab_screenshot():
-    with mss.mss() as sct:
-        sct_img = sct.grab(sct.monitors[1])
-        return Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+@tracing.traced("grab_screenshot")
+def grab_screenshot(region=None, monitor=None):
+    """
+    Screenshot as an RGB PIL image, of `region` (left, top, width, height) or of a monitor
+    (the one under the cursor by default). See `capture.ScreenCapture.grab`.
+    """
+    return screen_capture.grab(region=region, monitor=monitor).to_image()
     
 
+@tracing.traced("image_pil_to_base64")
 def image_pil_to_base64(image_pil):
     buffered = BytesIO()
     image_pil.save(buffered, format="PNG")
     image_data = buffered.getvalue()
     return base64.b64encode(image_data).decode("utf-8")
 
+def submit_background(fn, *args, **kwargs) -> Future:
+    """
+    Run `fn` on a daemon thread and return a Future for its result.
+    Unlike a ThreadPoolExecutor, an abandoned call never holds up process exit.
+    """
+    future = Future()
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name=getattr(fn, "__name__", None), daemon=True).start()
+    return future
+
+
+IMAGE_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+class EncodedImage:
+    def __init__(self, data: str, image_format: str, width: int, height: int, encode_ms: float):
+        self.data = data
+        self.image_format = image_format
+        self.mime_type = IMAGE_MIME_TYPES[image_format]
+        self.width = width
+        self.height = height
+        self.size = len(data)
+        self.encode_ms = encode_ms
+
+    def __str__(self):
+        return f"{self.width}x{self.height} {self.image_format} {self.size / 1024:.1f} KB in {self.encode_ms:.1f} ms"
+
+
+def _encode_base64(image_pil, image_format, quality=None):
+    buffered = BytesIO()
+    if image_format == "PNG":
+        image_pil.save(buffered, format="PNG")
+    else:
+        if image_format == "JPEG" and image_pil.mode != "RGB":
+            image_pil = image_pil.convert("RGB")
+        image_pil.save(buffered, format=image_format, quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+@tracing.traced("encode_image")
+def encode_image(image_pil, max_side=None, byte_budget=None, formats=("PNG", "JPEG"), qualities=(90, 80, 70, 60), max_downscales=3) -> EncodedImage:
+    """
+    Encode an image to base64 for a model call.
+    The image is first downscaled so its longest side is at most `max_side`. Formats are then tried
+    in order (lossy ones across `qualities`) until the base64 payload fits in `byte_budget`.
+    If nothing fits, the image is shrunk further; the smallest attempt is returned as a last resort.
+    """
+    start = time.perf_counter()
+    Image = lazy_import("PIL.Image")
+    if max_side is not None and max(image_pil.size) > max_side:
+        scale = max_side / max(image_pil.size)
+        image_pil = image_pil.resize(
+            (max(1, int(image_pil.width * scale)), max(1, int(image_pil.height * scale))),
+            resample=Image.Resampling.LANCZOS,
+            reducing_gap=3.0,
+        )
+
+    smallest = None
+    for _ in range(max_downscales + 1):
+        for image_format in formats:
+            for quality in ((None,) if image_format == "PNG" else qualities):
+                data = _encode_base64(image_pil, image_format, quality)
+                if smallest is None or len(data) < len(smallest[0]):
+                    smallest = (data, image_format, image_pil.size)
+                if byte_budget is None or len(data) <= byte_budget:
+                    return EncodedImage(data, image_format, *image_pil.size, (time.perf_counter() - start) * 1000)
+        image_pil = image_pil.resize(
+            (max(1, int(image_pil.width * 0.75)), max(1, int(image_pil.height * 0.75))),
+            resample=Image.Resampling.BILINEAR,
+        )
+    data, image_format, (width, height) = smallest
+    logger.log(f"Encoded image exceeds budget of {byte_budget} bytes: {len(data)} bytes")
+    return EncodedImage(data, image_format, width, height, (time.perf_counter() - start) * 1000)
+
+
 def copy_image_to_clipboard(file_path):
     system = platform.system()
     try:
@@ -36,3 +130,20 @@ def copy_image_to_clipboard(file_path):
     except Exception as e:
         logger.log(f"Failed to copy file to clipboard: {e}")
 
+
+def copy_image_bytes_to_clipboard(image_data: bytes, mime_type: str = "image/png"):
+    """
+    Copy in-memory image bytes to the clipboard; only platforms whose tools need a file get a temp file.
+    """
+    if platform.system() == "Linux":
+        try:
+            subprocess.run(['xclip', '-selection', 'clipboard', '-t', mime_type, '-i'], input=image_data)
+        except Exception as e:
+            logger.log(f"Failed to copy image to clipboard: {e}")
+        return
+    with tempfile.NamedTemporaryFile(delete=False, prefix='SelfAutomate.app_clipboard_') as tmp_file:
+        tmp_file.write(image_data)
+    try:
+        copy_image_to_clipboard(tmp_file.name)
+    finally:
+        os.remove(tmp_file.name)